@@ -1,6 +1,9 @@
+import copy
 import logging
+import math
 
 from common import *
+from environment import Environment as env
 import gbrtypes
 import numeric
 import command
@@ -19,6 +22,13 @@ class Aperture (Generator, Renderable, Appendable, gbrtypes.Polar):
   # attributes
   attributes = gbrtypes.ApertureAttributes
 
+  # Smallest rotation in degrees leaving shape unchanged, or 0 if any
+  # rotation does.
+  rotation_symmetry = 360.
+
+  # Whether shape is unchanged by negating x coordinates.
+  mirror_symmetry = False
+
   def __init__(self):
 
     # init attributes
@@ -58,6 +68,46 @@ class Aperture (Generator, Renderable, Appendable, gbrtypes.Polar):
     self.d_code = 'D%d'% (index)
     self.index = index
 
+  # Returns hashable key identifying apertures with identical definitions,
+  # or None if aperture cannot be shared.
+  def key(self): return None
+
+  # Returns radius of circle around origin containing shape, as canonical
+  # int, e.g. for bounding boxes.
+  def radius(self):
+    raise Exception('Radius not supported: %s' % (str(self)))
+
+  # Returns given linear numeric.Transform without components the shape is
+  # symmetric under, or None if only the identity remains, e.g. so mirrored
+  # circles do not need LM.
+  def reduce_transform(self, transform):
+
+    if transform is None:
+      return None
+
+    mirror = transform.mirror and not self.mirror_symmetry
+    rotation = 0.
+    if self.rotation_symmetry > 0:
+      rotation = transform.rotation % self.rotation_symmetry
+
+    ret = numeric.Transform(mirror, rotation, transform.scale)
+    return None if ret.identity else ret
+
+  # Returns unassigned copy of aperture with attributes of given
+  # ApertureAttributes added, e.g. those of a block stroking the aperture.
+  def annotate(self, attrs):
+
+    ret = copy.copy(self)
+    for name in ('d_code', 'index', 'definition'):
+      ret.__dict__.pop(name, None)
+
+    ret.attributes = gbrtypes.ApertureAttributes()
+    ret.attributes.append(list(self.attributes.attr_objs.values()))
+    ret.attributes.append(list(attrs.attr_objs.values()))
+    Appendable.__init__(ret, [(gbrtypes.Attribute, ret.attributes, None)])
+
+    return ret
+
   @property
   def assigned(self):
     if type(self.d_code) is type:
@@ -76,6 +126,9 @@ class StandardAperture (Aperture):
 
   precision = 6
 
+  # DefineAperture command, created once after assignment.
+  definition = None
+
   def __init__(self, hole=None):
     Aperture.__init__(self)
 
@@ -88,17 +141,37 @@ class StandardAperture (Aperture):
 
     Aperture.generate(self, stream)
 
-    params = list(self.params)
-    if not self.hole is None: params.append(self.hole)
-    params = 'X'.join(
-      [str(round(param, self.precision)) for param in params])
+    if self.definition is None:
+      params = list(self.params)
+      if not self.hole is None: params.append(self.hole)
+      params = 'X'.join(
+        [str(round(param, self.precision)) for param in params])
+
+      self.definition = command.DefineAperture(
+        self.d_code, self.template, params)
 
-    stream.append(command.DefineAperture(self.d_code, self.template, params))
+    stream.append(self.definition)
+
+  def assign(self, index):
+    Aperture.assign(self, index)
+    self.definition = None
+
+  def key(self):
+
+    attrs = ()
+    if self.attributes.attr_objs:
+      attrs = tuple(sorted([(name, tuple([str(v) for v in attr.values]))
+        for name, attr in self.attributes.attr_objs.items()]))
+
+    return (self.template, tuple(self.params), self.hole, attrs)
 
 class Circle (StandardAperture):
 
   template = 'C'
 
+  rotation_symmetry = 0.
+  mirror_symmetry = True
+
   def __init__(self, diameter, hole=None):
     StandardAperture.__init__(self, hole)
     self.params += [float(diameter)]
@@ -106,23 +179,40 @@ class Circle (StandardAperture):
   def __str__(self):
     return StandardAperture.__str__(self) + ' (Circle, dia=%s, hole=%s)' % (
       str(self.params[0]), str(self.hole))
+
+  def radius(self):
+    return int(math.ceil(self.params[0] * env.codec.scale / 2))
     
 class Rectangle (StandardAperture):
 
   template = 'R'
 
+  rotation_symmetry = 180.
+  mirror_symmetry = True
+
   def __init__(self, x_size, y_size, hole=None):
     StandardAperture.__init__(self, hole)
     self.params += [float(x_size), float(y_size)]
 
+  def radius(self):
+    return int(math.ceil(
+      math.hypot(self.params[0], self.params[1]) * env.codec.scale / 2))
+
 class Obround (StandardAperture):
 
   template = 'O'
 
+  rotation_symmetry = 180.
+  mirror_symmetry = True
+
   def __init__(self, x_size, y_size, hole=None):
     StandardAperture.__init__(self, hole)
     self.params += [float(x_size), float(y_size)]
 
+  def radius(self):
+    return int(math.ceil(
+      math.hypot(self.params[0], self.params[1]) * env.codec.scale / 2))
+
 class Polygon (StandardAperture):
 
   template = 'P'
@@ -130,6 +220,7 @@ class Polygon (StandardAperture):
   def __init__(self, diameter, vertices, rotation=0., hole=None):
     StandardAperture.__init__(self, hole)
     self.params += [float(diameter), int(vertices), float(rotation)]
+    self.rotation_symmetry = 360. / int(vertices)
 
   def __str__(self):
     return StandardAperture.__str__(self) + \
@@ -139,6 +230,9 @@ class Polygon (StandardAperture):
         str(self.params[2]),
         str(self.hole))
 
+  def radius(self):
+    return int(math.ceil(self.params[0] * env.codec.scale / 2))
+
 class Triangle (Polygon):
 
   def __init__(self, diameter, rotation=0., hole=None):
@@ -159,25 +253,129 @@ class Hexagon (Polygon):
   def __init__(self, diameter, rotation=0., hole=None):
     Polygon.__init__(self, diameter, 6, rotation, hole)
 
+# Block defined once and flashed at arbitrary positions, with its origin at
+# the flash position. Block is given in local coordinates.
 # Only supported in spec <2016.12>.
-# As of this writing there are no capable readers.
 class BlockAperture (Aperture):
 
   block = None
 
   def __init__(self, block, polarity=None):
-    Aperture.__init__(self, polarity)
+    Aperture.__init__(self)
+    gbrtypes.Polar.__init__(self, polarity)
+
     self.block = block
 
+  def __str__(self):
+    return Aperture.__str__(self) + ' (Block, %s)' % (str(self.block))
+
+  # Flashes and tracks of block, whose apertures must be defined before this
+  # aperture.
+  @property
+  def flashes(self): return self.block.flashes
+  @property
+  def tracks(self): return self.block.tracks
+
+  def radius(self):
+
+    bounds = self.block.bounds()
+    if bounds is None:
+      return 0
+
+    x_min, y_min, x_max, y_max = bounds
+    return int(math.ceil(math.hypot(max(-x_min, x_max), max(-y_min, y_max))))
+
   def generate(self, stream):
-    Aperture.generate(stream)
+    Aperture.generate(self, stream)
 
-    stream.append(command.Comment('Adding block aperture: ' + str(self)))
+    if env.profile.comments:
+      stream.append(command.Comment('Adding block aperture: ' + self.d_code))
+
+    # block does not depend on modal state set before
+    env.engine.state.reset()
 
     stream.append(command.DefineBlockStart(self.d_code))
     self.block.generate(stream)
     stream.append(command.DefineBlockEnd())
 
+    # current point and modes are undefined after block
+    env.engine.state.reset()
+
+# ------------------------------------------------------------------------------
+# Assigns D-codes to apertures, interning identical standard apertures to a
+# single D-code. May be shared by all layers of a board, in which case each
+# aperture receives the same D-code in every layer using it.
+# ------------------------------------------------------------------------------
+class Registry:
+
+  # nn of first D-code.
+  base = int
+
+  # nn of next D-code to assign.
+  index = int
+
+  # Canonical apertures by key.
+  apertures = dict
+
+  # Canonical apertures by id, e.g. to find apertures which cannot be
+  # shared without a key. Duplicates are not recorded, so they can be freed.
+  members = dict
+
+  def __init__(self, base=DNN_BASE):
+
+    self.base = base
+    self.index = base
+    self.apertures = dict()
+    self.members = dict()
+
+  def __len__(self):
+    return self.index - self.base
+
+  # Returns canonical aperture for given aperture, assigning a D-code if
+  # no identical aperture is registered yet. Given aperture is assigned
+  # the canonical D-code if not already assigned elsewhere.
+  def intern(self, ap):
+
+    canonical = self.members.get(id(ap))
+    if not canonical is None:
+      return canonical
+
+    key = ap.key()
+    canonical = None if key is None else self.apertures.get(key)
+
+    if canonical is None:
+
+      # keep apertures assigned by another registry intact
+      canonical = copy.copy(ap) if ap.assigned else ap
+
+      canonical.assign(self.index)
+      self.index += 1
+
+      if not key is None:
+        self.apertures[key] = canonical
+
+    if not ap.assigned:
+      ap.assign(canonical.index)
+
+    self.members[id(canonical)] = canonical
+
+    return canonical
+
+  # Returns canonical aperture for given aperture if it was interned or is
+  # identical to an interned aperture, otherwise None. Unlike intern(), the
+  # given aperture is not assigned a D-code.
+  def lookup(self, ap):
+
+    canonical = self.members.get(id(ap))
+    if not canonical is None:
+      return canonical
+
+    key = ap.key()
+    if key is None:
+      return None
+
+    return self.apertures.get(key)
+
 # Macros and associated template dictionary not supported.
 class Macro (Aperture): pass
 class TemplateDict (Generator): pass
@@ -0,0 +1,207 @@
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import tempfile
+import time
+import tracemalloc
+
+import gbrtypes
+import aperture
+import graphic
+import layer
+import stream
+from environment import Environment as env
+
+COORD_FORMAT = gbrtypes.CoordinateFormat(2, 6)
+UNIT = gbrtypes.Inch
+
+BOARD_SIZE = 10.000
+
+# size of synthetic features
+FEATURE_SIZE = 0.020
+
+# parameters of each case:
+#   regions: # of regions
+#   flashes: # of flashes
+#   apertures: # of distinct apertures used by flashes
+#   arcs: if True, regions are circles, otherwise rectangles
+#   depth: nesting depth of blocks containing regions, 0 for no blocks
+#   fanout: # of objects per block
+CASES = [
+  dict(name='regions_lines', regions=20000, flashes=0, apertures=1,
+    arcs=False, depth=0, fanout=0),
+  dict(name='regions_arcs', regions=20000, flashes=0, apertures=1,
+    arcs=True, depth=0, fanout=0),
+  dict(name='flashes', regions=0, flashes=50000, apertures=10,
+    arcs=False, depth=0, fanout=0),
+  dict(name='flashes_many_apertures', regions=0, flashes=50000,
+    apertures=1000, arcs=False, depth=0, fanout=0),
+  dict(name='nested_blocks', regions=20000, flashes=5000, apertures=10,
+    arcs=True, depth=3, fanout=8),
+  dict(name='mixed', regions=10000, flashes=20000, apertures=50,
+    arcs=True, depth=1, fanout=16),
+]
+
+# Sink discarding everything written, to time generation without I/O.
+class NullSink:
+  def write(self, data): pass
+
+def rect(center, width, height):
+
+  return graphic.Region([
+    (center[0] - width / 2, center[1] - height / 2),
+    (center[0] + width / 2, center[1] - height / 2),
+    (center[0] + width / 2, center[1] + height / 2),
+    (center[0] - width / 2, center[1] + height / 2),
+  ])
+
+def circle(center, radius):
+
+  start = (center[0] + radius, center[1])
+  return graphic.Region([
+    graphic.Segment((start, start), gbrtypes.CounterClockwise(),
+      center=center),
+  ])
+
+# Nests given objects into blocks of fanout objects, depth levels deep.
+def nest(objs, depth, fanout):
+
+  for level in range(depth):
+    blocks = list()
+    for idx in range(0, len(objs), fanout):
+      blocks.append(graphic.Block(objs[idx:idx + fanout]))
+    objs = blocks
+
+  return objs
+
+def build(case, scale):
+
+  rand = random.Random(0)
+
+  def position():
+    return (rand.uniform(0, BOARD_SIZE), rand.uniform(0, BOARD_SIZE))
+
+  l = layer.CopperLayer(1)
+
+  regions = list()
+  for idx in range(int(case['regions'] * scale)):
+    if case['arcs']:
+      regions.append(circle(position(), FEATURE_SIZE / 2))
+    else:
+      regions.append(rect(position(), FEATURE_SIZE, FEATURE_SIZE / 2))
+
+  for obj in nest(regions, case['depth'], case['fanout']):
+    l.append(obj)
+
+  # apertures are created inline per flash, as scripts typically do
+  sizes = [FEATURE_SIZE * (1 + idx / 100.) for idx in range(case['apertures'])]
+  for idx in range(int(case['flashes'] * scale)):
+    ap = aperture.Circle(sizes[idx % len(sizes)])
+    l.append(graphic.FlashObject(ap, position()))
+
+  return l
+
+def generate(l):
+  out = stream.Stream(NullSink())
+  l.generate(out)
+  out.flush()
+  return out.count
+
+def write(l, directory):
+  path = os.path.join(directory, 'bench.GBR')
+  stats = l.write(path)
+  return (os.path.getsize(path), stats)
+
+# Returns (seconds, result) of fastest of repeat calls.
+def timed(func, repeat):
+
+  best = None
+  for idx in range(repeat):
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    if best is None or elapsed < best[0]:
+      best = (elapsed, result)
+
+  return best
+
+# Returns (peak bytes, result) of given call.
+def traced(func):
+
+  tracemalloc.start()
+  result = func()
+  peak = tracemalloc.get_traced_memory()[1]
+  tracemalloc.stop()
+
+  return (peak, result)
+
+def run(case, scale, repeat, directory):
+
+  build_s, l = timed(lambda: build(case, scale), repeat)
+  generate_s, commands = timed(lambda: generate(l), repeat)
+  write_s, (size, stats) = timed(lambda: write(l, directory), repeat)
+
+  build_peak, l = traced(lambda: build(case, scale))
+  generate_peak, commands = traced(lambda: generate(l))
+  write_peak, (size, _) = traced(lambda: write(l, directory))
+
+  return dict(case, scale=scale,
+    build_s=build_s, generate_s=generate_s, write_s=write_s,
+    build_peak_bytes=build_peak, generate_peak_bytes=generate_peak,
+    write_peak_bytes=write_peak,
+    write_phases_s=stats.phases, suppressed=stats.suppressed,
+    commands=commands, bytes_written=size,
+    write_mb_s=size / write_s / 1e6)
+
+def main():
+
+  parser = argparse.ArgumentParser(
+    description='Benchmark pygbr using synthetic layers.')
+  parser.add_argument('--output', default='bench_output.json',
+    help='path of JSON results')
+  parser.add_argument('--scale', type=float, default=1.,
+    help='multiplier for object counts')
+  parser.add_argument('--repeat', type=int, default=3,
+    help='number of timings per phase, fastest is recorded')
+  parser.add_argument('--case', action='append',
+    help='name of case to run, may be given multiple times')
+  args = parser.parse_args()
+
+  # per-object logging is not part of what is measured
+  logging.basicConfig(
+    level=logging.WARNING,
+    format='%(levelname)-9s | %(message)s')
+
+  env.init(COORD_FORMAT, UNIT)
+
+  cases = CASES
+  if not args.case is None:
+    cases = [case for case in CASES if case['name'] in args.case]
+
+  results = list()
+  with tempfile.TemporaryDirectory() as directory:
+    for case in cases:
+      result = run(case, args.scale, args.repeat, directory)
+      results.append(result)
+
+      print('%-24s build %7.3fs  generate %7.3fs  write %7.3fs  '
+        'peak %6.1f MB' % (case['name'], result['build_s'],
+        result['generate_s'], result['write_s'],
+        max(result['build_peak_bytes'], result['generate_peak_bytes'],
+          result['write_peak_bytes']) / 1e6))
+
+  output = dict(
+    date=datetime.datetime.now().isoformat(),
+    python=platform.python_version(),
+    platform=platform.platform(),
+    results=results)
+
+  with open(args.output, 'w') as fh:
+    json.dump(output, fh, indent=2)
+
+if __name__ == '__main__':
+  main()
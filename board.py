@@ -0,0 +1,88 @@
+import concurrent.futures
+import logging
+import os
+import zipfile
+
+from common import *
+from environment import Environment as env
+import environment
+import aperture
+import stream
+
+# ------------------------------------------------------------------------------
+# Collection of layers making up a board. Layers share an aperture registry
+# so D-codes are consistent across the board, and are exported together.
+# ------------------------------------------------------------------------------
+class Board:
+
+  # List of (layer, filename) tuples in order added.
+  layers = list
+
+  # Registry to pass to layers created for this board.
+  registry = aperture.Registry
+
+  def __init__(self, registry=None):
+
+    if registry is None: registry = aperture.Registry()
+
+    self.layers = list()
+    self.registry = registry
+
+  # Add layer to be written to given filename, relative to output directory.
+  def add(self, layer, filename):
+    self.layers.append((layer, filename))
+
+  # Write all layers to given directory.
+  # processes: number of worker processes; None to use all cores,
+  #   1 to write serially in this process
+  # profile: environment.Profile to render with; defaults to that of the
+  #   current environment
+  # Layers are fully built, including D-code assignment, before export, so
+  # output is identical regardless of the number of processes.
+  def write(self, directory, processes=None, profile=None):
+
+    if not os.path.exists(directory):
+      os.mkdir(directory)
+
+    paths = [os.path.join(directory, filename)
+      for layer, filename in self.layers]
+
+    if processes is None: processes = os.cpu_count()
+    processes = min(processes, len(self.layers))
+
+    if processes <= 1:
+      for (layer, filename), path in zip(self.layers, paths):
+        layer.write(path, profile)
+    else:
+      with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        if profile is None: profile = env.profile
+
+        futures = [executor.submit(environment.call_scoped, env.cf, env.unit,
+          profile, layer.write, path)
+          for (layer, filename), path in zip(self.layers, paths)]
+
+        # propagate any exceptions
+        [future.result() for future in futures]
+
+    logging.info('Wrote %d layers to "%s" using %d processes' % (
+      len(self.layers), directory, max(processes, 1)))
+
+    return paths
+
+  # Write all layers as members of a zip archive at given path. Each layer is
+  # rendered directly into its member, compressed on a worker thread, so no
+  # uncompressed file is written.
+  # profile: environment.Profile to render with; defaults to that of the
+  #   current environment
+  def write_archive(self, path, profile=None, compresslevel=None):
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED,
+      compresslevel=compresslevel) as archive:
+
+      for layer, filename in self.layers:
+        with stream.ThreadedSink(archive.open(filename, 'w')) as sink:
+          layer.write(sink, profile)
+
+    logging.info('Wrote %d layers to "%s"' % (len(self.layers), path))
+
+    return path
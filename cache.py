@@ -0,0 +1,225 @@
+import array
+import collections
+import copy
+
+from common import *
+from environment import Environment as env
+import numeric
+import command
+import tracing
+
+# ------------------------------------------------------------------------------
+# Cache of blocks rendered in local coordinates, for repeated sub-designs
+# placed at different positions, e.g. footprints.
+#
+# A block is generated once with a fresh engine into a Fragment: the
+# coordinates of all points as fixed-point ints, and all other text, e.g.
+# opcodes and mode and aperture selection, pre-rendered in between. Placing
+# the fragment adds the offset to the ints and renders only the coordinates,
+# so no graphics objects are translated and no modal state is tracked.
+# Fragments are keyed by a digest of the block's geometry, so separately
+# built identical blocks share an entry, and evicted least recently used.
+# Output depends on the environment, so each Context has its own cache.
+# ------------------------------------------------------------------------------
+
+# Generated output of a block in local coordinates.
+class Fragment:
+
+  # Coordinates of all points, as interleaved x/y canonical ints.
+  points = array.array
+
+  # Text preceding each point, e.g. opcode of the point before and literal
+  # lines, followed by text after the last point; one more than the number
+  # of points.
+  parts = list
+
+  # Indices of points rendered without a current point, i.e. with all
+  # coordinates in compact profile.
+  starts = list
+
+  # Engine state after generating the block, in local coordinates.
+  state = None
+
+  def __init__(self, points, parts, starts, state):
+    self.points = points
+    self.parts = parts
+    self.starts = starts
+    self.state = state
+
+  def __len__(self):
+    return len(self.points) // 2
+
+  # Whether fragment generates no lines.
+  @property
+  def empty(self): return self.parts == ['']
+
+  # Returns fragment placed at given offset, as canonical tuple of ints,
+  # rendered as a single string of lines.
+  def render(self, offset):
+
+    codec = env.codec
+    points = numeric.translate_points(self.points, offset)
+
+    if codec.compact:
+      coords = list()
+      ends = self.starts[1:] + [len(self)]
+      for start, end in zip(self.starts, ends):
+        coords += codec.render_vectors(points[2 * start:2 * end])
+    else:
+      coords = codec.render_vectors(points)
+
+    ret = [None] * (2 * len(coords) + 1)
+    ret[0::2] = self.parts
+    ret[1::2] = coords
+    return ''.join(ret)
+
+  # Returns engine state after placing fragment at given offset.
+  def place_state(self, offset):
+
+    state = copy.copy(self.state)
+    for name in ('vector', 'center'):
+      val = getattr(state, name)
+      if not val is None:
+        setattr(state, name, (val[0] + offset[0], val[1] + offset[1]))
+
+    return state
+
+# Fragment placed at an offset, rendered as multiple lines.
+class Placement (Renderable):
+
+  fragment = Fragment
+
+  # Offset as canonical tuple of ints.
+  offset = tuple
+
+  def __init__(self, fragment, offset):
+    self.fragment = fragment
+    self.offset = offset
+
+  def render(self):
+    return self.fragment.render(self.offset)
+
+# Stream recording generated commands into the points and text of a Fragment
+# rather than rendering them to a sink.
+class Recorder:
+
+  points = array.array
+  parts = list
+  starts = list
+
+  # Text following the last point recorded, as list of lines.
+  pending = list
+
+  # Last point recorded, as canonical tuple of ints.
+  last = tuple
+
+  def __init__(self):
+
+    self.points = array.array('q')
+    self.parts = list()
+    self.starts = list()
+    self.pending = list()
+    self.last = None
+
+  def append(self, cmd):
+
+    cls = type(cmd)
+
+    if issubclass(cls, command.OperationCodeCommand):
+      self.append_point(cmd.val, cmd.suffix(), cmd.prev)
+
+    elif issubclass(cls, command.FlashArray):
+      end = cmd.opcode + '*'
+      prev = cmd.prev
+      for point in zip(cmd.points[0::2], cmd.points[1::2]):
+        self.append_point(point, end, prev)
+        prev = point
+
+    elif issubclass(cls, Renderable):
+      self.pending.append(cmd.render())
+    elif issubclass(cls, Generator):
+      cmd.generate(self)
+    else:
+      raise Exception('Command not renderable: %s' % (str(cmd)))
+
+  # Appends point followed by given text. prev is the current point before,
+  # which must be None or the last point recorded.
+  def append_point(self, point, suffix, prev):
+
+    if prev is None:
+      self.starts.append(len(self.parts))
+    elif not prev == self.last:
+      raise Exception('Current point not recorded: %s' % (str(prev)))
+
+    self.parts.append(''.join([line + '\n' for line in self.pending]))
+    self.points.extend(point)
+
+    self.pending = [suffix]
+    self.last = point
+
+  # Returns Fragment of commands recorded with given final engine state.
+  def fragment(self, state):
+    return Fragment(self.points, self.parts + ['\n'.join(self.pending)],
+      self.starts, state)
+
+# Least recently used cache of Fragments by geometry digest.
+class RenderCache:
+
+  # Fragments by key, least recently used first.
+  fragments = collections.OrderedDict
+
+  # Maximum number of fragments kept.
+  max_len = int
+
+  # (block, digest) by block id. Graphics are not modified while generated,
+  # so each block is digested once per cache.
+  digests = dict
+
+  # Number of lookups found and not found, respectively.
+  hits = int
+  misses = int
+
+  def __init__(self, max_len=256):
+
+    self.fragments = collections.OrderedDict()
+    self.digests = dict()
+    self.max_len = max_len
+    self.hits = 0
+    self.misses = 0
+
+  # Returns Fragment of given block, generating it if not cached.
+  def fragment(self, block):
+
+    entry = self.digests.get(id(block))
+    if entry is None:
+      entry = (block, block.digest())
+      self.digests[id(block)] = entry
+    key = entry[1]
+
+    fragment = self.fragments.get(key)
+    if not fragment is None:
+      self.fragments.move_to_end(key)
+      self.hits += 1
+      return fragment
+
+    self.misses += 1
+    if tracing.enabled:
+      tracing.trace('cache', 'Rendering block %s into cache', block)
+
+    fragment = capture(block)
+
+    self.fragments[key] = fragment
+    if len(self.fragments) > self.max_len:
+      self.fragments.popitem(last=False)
+
+    return fragment
+
+# Generates given block with a fresh engine, so its output does not depend
+# on modal state set before. Returns Fragment.
+def capture(block):
+
+  recorder = Recorder()
+
+  with env.scope():
+    block.generate(recorder)
+    return recorder.fragment(env.engine.state)
@@ -1,4 +1,5 @@
 from common import *
+from environment import Environment as env
 import gbrtypes
 import numeric
 
@@ -26,21 +27,47 @@ class FunctionCodeCommand (Command):
 # D01, D02, D03
 class OperationCodeCommand (FunctionCodeCommand):
 
-  vector = numeric.Vector
-  offset = numeric.Vector
+  # Coordinates as canonical tuple of ints.
+  val = tuple
 
-  def __init__(self, vector, offset=None):
+  # Offset as canonical tuple of ints, if applicable.
+  offset_val = tuple
+
+  # Current point before this command as canonical tuple of ints, if known.
+  prev = tuple
+
+  # vector/offset: Vector or tuple, converted to canonical ints
+  # val/offset_val: canonical ints given explicitly, e.g. by Engine
+  # prev: current point, so unchanged coordinates can be omitted
+  def __init__(self, vector=None, offset=None, val=None, offset_val=None,
+    prev=None):
     FunctionCodeCommand.__init__(self)
 
-    self.vector = vector
-    self.offset = offset
+    if val is None: val = numeric.Vector.quantize(vector)
+    if offset_val is None and not offset is None:
+      offset_val = numeric.Vector.quantize(offset)
 
-  def render(self):
+    self.val = val
+    self.offset_val = offset_val
+    self.prev = prev
+
+  # Coordinates as Vector.
+  @property
+  def vector(self):
+    return numeric.Vector.from_fixed(self.val)
 
+  # Renders offset, if any, and opcode following coordinates. Independent of
+  # the position of the command.
+  def suffix(self):
+
+    # omitted offsets default to zero
     offset = ''
-    if not self.offset is None:
-      offset = self.offset.render(('I', 'J'))
-    return '%s%s%s*' % (self.vector.render(), offset, self.opcode)
+    if not self.offset_val is None:
+      offset = env.codec.render_vector(self.offset_val, ('I', 'J'), (0, 0))
+    return '%s%s*' % (offset, self.opcode)
+
+  def render(self):
+    return env.codec.render_vector(self.val, prev=self.prev) + self.suffix()
 
 class Interpolate (OperationCodeCommand):
   opcode = 'D01'
@@ -51,6 +78,27 @@ class Move (OperationCodeCommand):
 class Flash (OperationCodeCommand):
   opcode = 'D03'
 
+# Flashes at each of a point array, rendered as one line per point.
+class FlashArray (FunctionCodeCommand):
+  opcode = 'D03'
+
+  # Point array of canonical ints, see numeric.points_from_buffer().
+  points = None
+
+  # Current point before first flash as canonical tuple of ints, if known.
+  prev = tuple
+
+  def __init__(self, points, prev=None):
+    FunctionCodeCommand.__init__(self)
+
+    self.points = points
+    self.prev = prev
+
+  def render(self):
+    end = '%s*' % (self.opcode)
+    return (end + '\n').join(
+      env.codec.render_vectors(self.points, prev=self.prev)) + end
+
 class SetAperture (FunctionCodeCommand):
 
   # Dnn, nn >= 10
@@ -124,10 +172,18 @@ class SetCoordinateFormat (ExtendedCodeCommand):
 class DefineAperture (ExtendedCodeCommand):
   opcode = 'AD'
 
+  # Rendered text, cached since definitions are reused across layers.
+  text = None
+
   def __init__(self, d_code, template, params):
     ExtendedCodeCommand.__init__(self)
     self.data.append('%s%s,%s' % (d_code, template, params))
 
+  def render(self):
+    if self.text is None:
+      self.text = ExtendedCodeCommand.render(self)
+    return self.text
+
 class DefineMacroAperture (ExtendedCodeCommand):
   opcode = 'AM'
 
@@ -152,18 +208,48 @@ class LoadPolarity (ExtendedCodeCommand):
     ExtendedCodeCommand.__init__(self)
     self.data.append(polarity.render())
 
+# Renders given float with up to given decimal places, without trailing
+# zeros.
+def render_decimal(val, precision=6):
+  return ('%.*f' % (precision, val)).rstrip('0').rstrip('.')
+
+# mirror: 'N', 'X', 'Y' or 'XY'
 class LoadMirror (ExtendedCodeCommand):
   opcode = 'LM'
 
+  def __init__(self, mirror):
+    ExtendedCodeCommand.__init__(self)
+    self.data.append(mirror)
+
+# Counterclockwise rotation in degrees.
 class LoadRotation (ExtendedCodeCommand):
   opcode = 'LR'
 
+  def __init__(self, rotation):
+    ExtendedCodeCommand.__init__(self)
+    self.data.append(render_decimal(rotation, numeric.Transform.precision))
+
 class LoadScale (ExtendedCodeCommand):
   opcode = 'LS'
 
+  def __init__(self, scale):
+    ExtendedCodeCommand.__init__(self)
+    self.data.append(render_decimal(scale, numeric.Transform.precision))
+
+# Opens step and repeat block with given counts and step distances, or
+# closes current block if no counts given. Steps are rendered with given
+# number of decimal places.
 class StepRepeat (ExtendedCodeCommand):
   opcode = 'SR'
 
+  def __init__(self, x_count=None, y_count=None, x_step=0., y_step=0.,
+    precision=6):
+    ExtendedCodeCommand.__init__(self)
+
+    if not x_count is None:
+      self.data.append('X%dY%dI%sJ%s' % (x_count, y_count,
+        render_decimal(x_step, precision), render_decimal(y_step, precision)))
+
 class AddFileAttribute (ExtendedCodeCommand):
   opcode = 'TF'
 
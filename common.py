@@ -1,3 +1,5 @@
+import itertools
+
 # ------------------------------------------------------------------------------
 # Text definitions.
 # ------------------------------------------------------------------------------
@@ -31,11 +33,33 @@ class Generator:
 class Appendable:
 
   # Maps classes to internal appendable objects.
-  # todo: list of tuples: (class, obj_list, cb)
+  # List of tuples: (class, obj_list, cb) or (class, obj_list, cb, batch_cb).
+  # cb is invoked per object; batch_cb, if given, is invoked by extend()
+  # instead with a list of objects of the same class.
   obj_map = list
 
+  # (obj_list, cb, batch_cb) resolved from obj_map by concrete class.
+  handlers = dict
+
   def __init__(self, obj_map):
     self.obj_map = obj_map
+    self.handlers = dict()
+
+  # Returns (obj_list, cb, batch_cb) of first obj_map entry matching given
+  # class.
+  def handler(self, cls):
+
+    handler = self.handlers.get(cls)
+    if not handler is None:
+      return handler
+
+    for entry in self.obj_map:
+      if issubclass(cls, entry[0]):
+        handler = (entry[1], entry[2], entry[3] if len(entry) > 3 else None)
+        self.handlers[cls] = handler
+        return handler
+
+    raise Exception('Unsupported object: ' + cls.__name__)
 
   # Append given object to appropriate internal data structure.
   # If not given as list, will be converted to list before processing.
@@ -43,24 +67,32 @@ class Appendable:
     objs = Appendable.normalize(objs)
 
     for obj in objs:
-      found = False
+      obj_list, cb, batch_cb = self.handler(type(obj))
+
+      # append to list
+      if not obj_list is None:
+        obj_list.append(obj)
 
-      for cls, obj_list, cb in self.obj_map:
-        if issubclass(type(obj), cls):
+      # invoke callback
+      if not cb is None:
+        cb(obj)
 
-          # append to list
-          if not obj_list is None:
-            obj_list.append(obj)
+  # Append objects from given iterable, e.g. a list or generator. Runs of
+  # objects of the same class are handled together: appended to the list
+  # at once and passed to the batch callback, if any.
+  def extend(self, objs):
 
-          # invoke callback
-          if not cb is None:
-            cb(obj)
+    for cls, run in itertools.groupby(objs, type):
+      obj_list, cb, batch_cb = self.handler(cls)
+      run = list(run)
 
-          found = True
-          break
+      if not obj_list is None:
+        obj_list.extend(run)
 
-      if not found:
-        raise Exception('Unsupported object: ' + type(obj).__name__)
+      if not batch_cb is None:
+        batch_cb(run)
+      elif not cb is None:
+        for obj in run: cb(obj)
 
   @classmethod
   def normalize(cls, objs):
@@ -0,0 +1,325 @@
+import concurrent.futures
+import logging
+import math
+import os
+
+from common import *
+from environment import Environment as env
+import environment
+import gbrtypes
+import numeric
+import graphic
+import spatial
+import tracing
+
+# ------------------------------------------------------------------------------
+# Design rule check of a layer: minimum clearance between dark graphics,
+# minimum feature width and minimum annular ring of flashed apertures with
+# holes.
+#
+# Graphics are checked as the shapes of spatial.py. Graphics whose shapes
+# touch or overlap are taken to be connected, as are graphics connected
+# through others, and are not checked for clearance against each other.
+# Graphics of clear polarity are not checked, and do not cut graphics below
+# them.
+#
+# The layer is split into square tiles checked independently, in parallel
+# if processes are used. Each graphic is checked in every tile its bounds,
+# expanded by half the clearance, overlap, so any pair closer than the
+# clearance shares a tile.
+# ------------------------------------------------------------------------------
+
+# Result of a failed rule.
+class Violation:
+
+  # Name of rule: 'clearance', 'width' or 'annular'.
+  rule = str
+
+  # Graphics violating rule: two for clearance, otherwise one. Graphics
+  # nested in blocks are given by the top-level graphic.
+  objects = tuple
+
+  # Value measured and minimum required, in units.
+  measured = float
+  limit = float
+
+  # Approximate location as tuple of floats in units.
+  location = tuple
+
+  def __init__(self, rule, objects, measured, limit, location):
+    self.rule = rule
+    self.objects = objects
+    self.measured = measured
+    self.limit = limit
+    self.location = location
+
+  def __str__(self):
+    return 'Violation (%s, %.6g < %.6g at (%.6g, %.6g))' % ((self.rule,
+      self.measured, self.limit) + self.location)
+
+# Checks given layer, returning list of Violations ordered by rule and
+# location.
+# clearance, width, annular: minimum values in units; None to skip rule
+# processes: number of worker processes; None to use all cores, 1 to check
+#   serially in this process
+# tile: side of tiles in units; if None, chosen to give several tiles per
+#   process
+def check(layer, clearance=None, width=None, annular=None, processes=1,
+  tile=None):
+
+  objs = [obj for obj in layer.graphics if hasattr(obj, 'bounds') and
+    (not hasattr(obj, 'polarity') or obj.polarity == gbrtypes.Dark)]
+  bounds = [obj.bounds() for obj in objs]
+
+  ids = [idx for idx, val in enumerate(bounds) if not val is None]
+  if len(ids) == 0:
+    return list()
+
+  scale = env.codec.scale
+  limits = tuple([None if val is None else val * scale
+    for val in (clearance, width, annular)])
+  margin = 0 if clearance is None else int(math.ceil(clearance * scale / 2))
+
+  if processes is None: processes = os.cpu_count()
+  processes = max(processes, 1)
+
+  # tiles of graphics by (column, row), each by bounds expanded by margin
+  extent = graphic.union_bounds([bounds[idx] for idx in ids])
+  if tile is None:
+    side = max(extent[2] - extent[0], extent[3] - extent[1])
+    side = max(1, int(math.ceil(side / math.ceil(math.sqrt(4 * processes)))))
+  else:
+    side = max(1, numeric.Scalar.quantize(tile))
+
+  tiles = dict()
+  for idx in ids:
+    x_min, y_min, x_max, y_max = graphic.expand_bounds(bounds[idx], margin)
+    for col in range(x_min // side, x_max // side + 1):
+      for row in range(y_min // side, y_max // side + 1):
+        tiles.setdefault((col, row), list()).append(idx)
+
+  tasks = [(key, [objs[idx] for idx in tile_ids], tile_ids)
+    for key, tile_ids in sorted(tiles.items())]
+
+  if processes <= 1 or len(tasks) <= 1:
+    results = [check_tile(key, tile_objs, tile_ids, side, limits)
+      for key, tile_objs, tile_ids in tasks]
+  else:
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+      futures = [executor.submit(environment.call_scoped, env.cf, env.unit,
+        env.profile, check_tile, key, tile_objs, tile_ids, side, limits)
+        for key, tile_objs, tile_ids in tasks]
+      results = [future.result() for future in futures]
+
+  # pairs within clearance, each found in one or more tiles
+  pairs = dict()
+  violations = list()
+  for tile_pairs, tile_violations in results:
+    pairs.update(tile_pairs)
+    violations += tile_violations
+
+  violations += clearance_violations(objs, pairs, limits[0])
+
+  if tracing.enabled:
+    tracing.trace('drc', 'Layer %s: %d violations in %d tiles', layer,
+      len(violations), len(tasks))
+
+  logging.info('Checked %d graphics in %d tiles: %d violations' % (
+    len(ids), len(tasks), len(violations)))
+
+  violations = [Violation(rule, tuple([objs[idx] for idx in obj_ids]),
+    measured / scale, limit / scale, (location[0] / scale,
+      location[1] / scale))
+    for rule, obj_ids, measured, limit, location in violations]
+
+  order = ('clearance', 'width', 'annular')
+  violations.sort(key=lambda val: (order.index(val.rule), val.location))
+
+  return violations
+
+# Checks given graphics of tile at given (column, row), with given ids in
+# the layer and limits as canonical values or None.
+# Returns ({(id, id): (distance, location)} of pairs within clearance,
+# list of (rule, ids, measured, limit, location) for other rules), as
+# canonical values. Width and annular ring are checked only in the tile
+# containing the lower corner of a graphic's bounds, so they are found once.
+def check_tile(key, objs, ids, side, limits):
+
+  clearance, width, annular = limits
+  pairs = dict()
+  violations = list()
+
+  shapes = [[shape for shape in spatial.shapes(obj) if shape.dark]
+    for obj in objs]
+
+  index = spatial.GridIndex()
+  index.extend(objs)
+  bounds = index.bounds
+
+  if not clearance is None:
+    margin = int(math.ceil(clearance))
+    for idx, val in enumerate(bounds):
+      for other in index.candidates(graphic.expand_bounds(val, margin)):
+        if other <= idx or \
+          spatial.box_distance(val, bounds[other]) >= clearance:
+          continue
+
+        dist = object_distance(shapes[idx], shapes[other], clearance)
+        if dist < clearance:
+          pairs[(min(ids[idx], ids[other]), max(ids[idx], ids[other]))] = (
+            dist, gap_center(val, bounds[other]))
+
+  for idx, obj in enumerate(objs):
+    val = bounds[idx]
+    if not (val[0] // side, val[1] // side) == key:
+      continue
+
+    if not width is None:
+      for shape in shapes[idx]:
+        measured, location = shape_width(shape, width)
+        if measured < width:
+          violations.append(('width', (ids[idx],), measured, width,
+            location))
+
+    if not annular is None:
+      for measured, location in flash_rings(obj):
+        if measured < annular:
+          violations.append(('annular', (ids[idx],), measured, annular,
+            location))
+
+  return (pairs, violations)
+
+# Returns distance between given lists of shapes, computed exactly up to
+# given limit.
+def object_distance(shapes_a, shapes_b, limit):
+
+  ret = float('inf')
+
+  for a in shapes_a:
+    for b in shapes_b:
+      if spatial.box_distance(a.bounds, b.bounds) >= min(ret, limit):
+        continue
+      ret = min(ret, spatial.shape_distance(a, b, limit))
+      if ret == 0:
+        return ret
+
+  return ret
+
+# Returns point midway across gap or overlap between given bounds.
+def gap_center(a, b):
+  x = (max(a[0], b[0]) + min(a[2], b[2])) / 2
+  y = (max(a[1], b[1]) + min(a[3], b[3])) / 2
+  return (x, y)
+
+# Returns list of (rule, ids, measured, limit, location) for given pairs
+# within given clearance, skipping pairs connected through touching
+# graphics.
+def clearance_violations(objs, pairs, clearance):
+
+  if clearance is None:
+    return list()
+
+  # union-find of graphics touching
+  parents = dict()
+
+  def find(idx):
+    root = idx
+    while parents.get(root, root) != root:
+      root = parents[root]
+    while idx != root:
+      parents[idx], idx = root, parents.get(idx, idx)
+    return root
+
+  for (a, b), (dist, location) in pairs.items():
+    if dist == 0:
+      parents[find(a)] = find(b)
+
+  return [('clearance', (a, b), dist, clearance, location)
+    for (a, b), (dist, location) in sorted(pairs.items())
+    if dist > 0 and find(a) != find(b)]
+
+# Returns (width, location) of narrowest part of given shape, as canonical
+# values. Widths of polygons are measured from each vertex across to edges
+# facing it, only as far as given limit.
+def shape_width(shape, limit):
+
+  xs = shape.points[0::2]
+  ys = shape.points[1::2]
+
+  if not shape.filled or len(xs) < 3:
+    return (2 * shape.radius, (xs[0], ys[0]))
+
+  # interior is to the left of edges if counterclockwise
+  area = sum([x0 * y1 - x1 * y0 for x0, y0, x1, y1 in shape.edges()])
+  sign = 1 if area > 0 else -1
+
+  edges = shape.edges()
+  count = len(edges)
+  ret = (float('inf'), (xs[0], ys[0]))
+
+  for idx, (px, py) in enumerate(zip(xs, ys)):
+    box = (px, py, px, py)
+
+    # edges not ending at vertex, with vertex on their interior side and
+    # projecting onto them
+    for edge_idx, (x0, y0, x1, y1) in enumerate(
+      spatial.near_edges(edges, box, limit) if count > 8 else edges):
+      if (x0, y0) == (px, py) or (x1, y1) == (px, py):
+        continue
+
+      dx, dy = x1 - x0, y1 - y0
+      length = dx * dx + dy * dy
+      if length == 0 or sign * (dx * (py - y0) - dy * (px - x0)) <= 0:
+        continue
+      t = ((px - x0) * dx + (py - y0) * dy) / length
+      if t < 0 or t > 1:
+        continue
+
+      fx, fy = x0 + t * dx, y0 + t * dy
+      dist = math.hypot(px - fx, py - fy)
+      if dist < ret[0] and shape.encloses(
+        (int(round((px + fx) / 2)), int(round((py + fy) / 2)))):
+        ret = (dist, ((px + fx) / 2, (py + fy) / 2))
+
+  return ret
+
+# Yields (ring, location) of each flash of an aperture with a hole in given
+# graphic, including those nested in blocks, as canonical values. Ring is
+# half the difference between the narrowest width of the aperture and the
+# hole diameter.
+def flash_rings(obj, offset=(0, 0)):
+
+  cls = type(obj)
+
+  if issubclass(cls, graphic.FlashObject) or \
+    issubclass(cls, graphic.FlashArray):
+
+    ap = obj.ap
+    if getattr(ap, 'hole', None) is None:
+      return
+
+    if issubclass(cls, graphic.FlashObject):
+      points = [numeric.Vector.quantize(obj.vector)]
+    else:
+      points = list(zip(obj.points[0::2], obj.points[1::2]))
+
+    ap_scale = 1. if obj.ap_transform is None else obj.ap_transform.scale
+    outer = min([shape_width(shape, float('inf'))[0] for shape in
+      spatial.local_shapes(ap, obj.ap_transform)])
+    ring = (outer - ap.hole * env.codec.scale * ap_scale) / 2
+
+    for x, y in points:
+      yield (ring, (x + offset[0], y + offset[1]))
+
+  elif issubclass(cls, graphic.Block):
+    for nested in obj.objects:
+      if nested.polarity == gbrtypes.Dark:
+        yield from flash_rings(nested, offset)
+
+  elif issubclass(cls, graphic.Instance):
+    yield from flash_rings(obj.block,
+      (offset[0] + obj.offset[0], offset[1] + obj.offset[1]))
+
+  elif issubclass(cls, graphic.StepRepeat):
+    for x, y in obj.positions:
+      yield from flash_rings(obj.block, (offset[0] + x, offset[1] + y))
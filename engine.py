@@ -1,19 +1,25 @@
-import logging
-
 from common import *
 import gbrtypes
 import numeric
 import command
 import aperture
+import tracing
+
+# Shared interpolation mode for linear segments.
+LINEAR = gbrtypes.Linear()
+
+# Maximum number of points rendered per FlashArray command.
+FLASH_CHUNK_LEN = 1024
 
 # Internal state.
 class State:
 
-  # Current position.
-  vector = numeric.Vector
+  # Current position as canonical tuple of ints.
+  vector = tuple
 
   # Offset given as center in absolute coordinates, for Circular interpolation.
-  center = numeric.Vector
+  # Canonical tuple of ints.
+  center = tuple
 
   # Interpolation state.
   interp_mode = gbrtypes.InterpMode
@@ -21,11 +27,21 @@ class State:
 
   # Graphics state.
   polarity = gbrtypes.Polarity
-  rotation = gbrtypes.Rotation
+
+  # Aperture transformation loaded by LM/LR/LS. Unlike other modes, it is
+  # initialized by the file and never undefined, so is not reset.
+  mirror = bool
+  rotation = float
+  scale = float
 
   current_aperture = aperture.Aperture
 
   def __init__(self):
+
+    self.mirror = False
+    self.rotation = 0.
+    self.scale = 1.
+
     self.reset()
 
   def reset(self):
@@ -37,7 +53,6 @@ class State:
     self.interp_mode = None
     
     self.polarity = None
-    self.rotation = None
 
     self.current_aperture = None
 
@@ -47,62 +62,123 @@ class Engine:
   # graphics state
   state = State
 
+  # number of mode changes not generated since the mode was already set
+  suppressed = int
+
   def __init__(self):
 
     self.state = State()
+    self.suppressed = 0
 
-  def move(self, stream, vector):
-    vector = numeric.Vector(vector)
+  # vector: Vector or tuple, converted to canonical ints
+  # val: canonical ints given explicitly
+  def move(self, stream, vector=None, val=None):
+    if val is None: val = numeric.Vector.quantize(vector)
 
     # if not already at vector, generate Move command
-    if not self.state.vector == vector:
-      stream.append(command.Move(vector))
-      self.state.vector = vector
+    if not self.state.vector == val:
+      stream.append(command.Move(val=val, prev=self.state.vector))
+      self.state.vector = val
 
-  def interpolate(self, stream, vector):
-    vector = numeric.Vector(vector)
+  def interpolate(self, stream, vector=None, val=None):
+    if val is None: val = numeric.Vector.quantize(vector)
 
     # get offset, if applicable
     if issubclass(type(self.state.interp_mode), gbrtypes.Circular):
 
-      # create vector of signed diff
-      offset = numeric.Vector((
-        self.state.center.val[0] - self.state.vector.val[0],
-        self.state.center.val[1] - self.state.vector.val[1]))
+      # create signed diff
+      offset = (
+        self.state.center[0] - self.state.vector[0],
+        self.state.center[1] - self.state.vector[1])
 
       # check if offsets are unsigned
-      if self.state.quad_mode == gbrtypes.Single: offset = abs(offset)
+      if self.state.quad_mode == gbrtypes.SingleQuadrant:
+        offset = (abs(offset[0]), abs(offset[1]))
 
     else:
       offset = None
 
     # generate Interpolate command
-    stream.append(command.Interpolate(vector, offset))
+    stream.append(command.Interpolate(val=val, offset_val=offset,
+      prev=self.state.vector))
 
     # update current vector
-    self.state.vector = vector
+    self.state.vector = val
 
-  def flash(self, stream, ap, vector):
+  # Walks contour arrays, generating segments without allocating
+  # intermediate Vector objects per vertex.
+  def contour(self, stream, contour):
+    for start, end, arc in contour.edges():
+      self.edge(stream, start, end, arc)
 
-    vector = numeric.Vector(vector)
+  # Generates single segment from start to end with given arc metadata.
+  def edge(self, stream, start, end, arc=None):
 
-    if not self.state.current_aperture == ap:
+    if arc is None:
+      self.set_interp(stream, LINEAR)
+    else:
+      interp_mode, quad_mode, center = arc
+      self.set_interp(stream, interp_mode, val=center)
+      self.set_quad(stream, quad_mode)
+
+    # ensure current vector is at start
+    self.move(stream, val=start)
+
+    self.interpolate(stream, val=end)
+
+  def flash(self, stream, ap, vector=None, val=None):
+    if val is None: val = numeric.Vector.quantize(vector)
+
+    self.set_aperture(stream, ap)
+
+    stream.append(command.Flash(val=val, prev=self.state.vector))
+    self.state.vector = val
+
+  # Flashes given aperture at each of given point array.
+  def flash_array(self, stream, ap, points):
+
+    if len(points) == 0:
+      return
+
+    self.set_aperture(stream, ap)
+
+    # render in chunks to bound the size of each buffered command
+    step = 2 * FLASH_CHUNK_LEN
+    prev = self.state.vector
+    for idx in range(0, len(points), step):
+      chunk = points[idx:idx + step]
+      stream.append(command.FlashArray(chunk, prev))
+      prev = (chunk[-2], chunk[-1])
 
-      # set aperture
+    self.state.vector = prev
+
+  # Strokes given contour with given aperture.
+  def track(self, stream, ap, contour):
+
+    self.set_aperture(stream, ap)
+    self.contour(stream, contour)
+
+  def set_aperture(self, stream, ap):
+
+    if not self.state.current_aperture == ap:
       stream.append(command.SetAperture(ap))
       self.state.current_aperture = ap
 
-    stream.append(command.Flash(vector))
+    else:
+      self.suppressed += 1
 
-  def set_interp(self, stream, interp_mode, center=None):
+  def set_interp(self, stream, interp_mode, center=None, val=None):
 
     # note: center only valid for Circular interp mode
     if not center is None:
-      self.state.center = numeric.Vector(center)
+      val = numeric.Vector.quantize(center)
+    if not val is None:
+      self.state.center = val
 
     if not self.state.interp_mode == interp_mode:
 
-      logging.debug('Setting interpolation: ' + str(interp_mode))
+      if tracing.enabled:
+        tracing.trace('interp', 'Setting interpolation: %s', interp_mode)
 
       if interp_mode == gbrtypes.Linear:
         stream.append(command.SetInterpLinear())
@@ -115,16 +191,45 @@ class Engine:
 
       self.state.interp_mode = interp_mode
 
+    else:
+      self.suppressed += 1
+
+  # Loads given linear numeric.Transform, or the identity if None, as the
+  # aperture transformation.
+  def set_transform(self, stream, transform):
+
+    if transform is None:
+      mirror, rotation, scale = (False, 0., 1.)
+    else:
+      mirror, rotation, scale = (transform.mirror, transform.rotation,
+        transform.scale)
+
+    if not self.state.mirror == mirror:
+      stream.append(command.LoadMirror('X' if mirror else 'N'))
+      self.state.mirror = mirror
+
+    if not self.state.rotation == rotation:
+      stream.append(command.LoadRotation(rotation))
+      self.state.rotation = rotation
+
+    if not self.state.scale == scale:
+      stream.append(command.LoadScale(scale))
+      self.state.scale = scale
+
   def set_polarity(self, stream, polarity):
     if type(polarity) is type: polarity = polarity()
 
     if not self.state.polarity == polarity:
 
-      logging.debug('Setting polarity: ' + str(polarity))
+      if tracing.enabled:
+        tracing.trace('polarity', 'Setting polarity: %s', polarity)
 
       stream.append(command.LoadPolarity(polarity))
 
       self.state.polarity = polarity
+
+    else:
+      self.suppressed += 1
   
   def set_quad(self, stream, quad_mode):
     if type(quad_mode) is type: quad_mode = quad_mode()
@@ -143,9 +248,10 @@ class Engine:
 
       if not self.state.quad_mode == quad_mode:
 
-        logging.debug('Setting quadrant mode: ' + str(quad_mode))
+        if tracing.enabled:
+          tracing.trace('quad', 'Setting quadrant mode: %s', quad_mode)
 
-        if quad_mode == gbrtypes.Single:
+        if quad_mode == gbrtypes.SingleQuadrant:
           stream.append(command.SetQuadSingle())
         elif quad_mode == gbrtypes.Multi:
           stream.append(command.SetQuadMulti())
@@ -153,3 +259,6 @@ class Engine:
           raise Exception()
 
         self.state.quad_mode = quad_mode
+
+      else:
+        self.suppressed += 1
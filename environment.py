@@ -1,20 +1,134 @@
+import contextlib
+import contextvars
+
 from common import *
 import gbrtypes
 
-# GBR-level abstraction to contain top-level state.
-# Used as a singleton object.
-class Environment:
+# ------------------------------------------------------------------------------
+# Options controlling how output is rendered, independent of its image.
+# ------------------------------------------------------------------------------
+class Profile:
+
+  # Omit leading zeros of coordinates, and coordinates equal to those of the
+  # current point.
+  compact = bool
+
+  # Generate informational G04 comments.
+  comments = bool
+
+  def __init__(self, compact=False, comments=True):
+    self.compact = compact
+    self.comments = comments
+
+# ------------------------------------------------------------------------------
+# State owned by a single generation run: coordinate format, unit, output
+# profile, the engine maintaining modal state, and the cache of rendered
+# blocks.
+# ------------------------------------------------------------------------------
+class Context:
 
   cf = gbrtypes.CoordinateFormat
   unit = gbrtypes.Unit
+  profile = Profile
+
+  # numeric.Codec for cf and profile.
+  codec = None
 
   engine = None
 
-  @classmethod
-  def init(cls, cf, unit):
+  # cache.RenderCache of blocks rendered with this context.
+  cache = None
+
+  def __init__(self, cf, unit, profile=None):
 
-    cls.cf = cf
-    cls.unit = unit
+    if profile is None: profile = Profile()
+
+    self.cf = cf
+    self.unit = unit
+    self.profile = profile
+
+    import numeric
+    self.codec = numeric.Codec.get(cf, profile.compact)
 
     import engine
-    cls.engine = engine.Engine()
+    self.engine = engine.Engine()
+
+    import cache
+    self.cache = cache.RenderCache()
+
+# Exposes attributes of the current Context as class attributes of
+# Environment, e.g. env.cf, env.engine.
+class EnvironmentType (type):
+
+  @property
+  def cf(cls): return cls.current().cf
+
+  @property
+  def unit(cls): return cls.current().unit
+
+  @property
+  def profile(cls): return cls.current().profile
+
+  @property
+  def codec(cls): return cls.current().codec
+
+  @property
+  def engine(cls): return cls.current().engine
+
+  @property
+  def cache(cls): return cls.current().cache
+
+# ------------------------------------------------------------------------------
+# GBR-level abstraction to contain top-level state.
+#
+# State is held in a Context. A Context set by init() is used by default;
+# scope() sets a new Context for the current thread or asyncio task, so
+# independent layers or boards can be generated concurrently.
+# ------------------------------------------------------------------------------
+class Environment (metaclass=EnvironmentType):
+
+  # Context used outside of any scope.
+  default = None
+
+  # Context of current scope, if any.
+  context = contextvars.ContextVar('environment', default=None)
+
+  @classmethod
+  def init(cls, cf, unit, profile=None):
+    cls.default = Context(cf, unit, profile)
+
+  # Returns Context of current scope, or default Context.
+  @classmethod
+  def current(cls):
+
+    context = cls.context.get()
+    if context is None: context = cls.default
+    if context is None:
+      raise Exception('Environment not initialized')
+
+    return context
+
+  # Sets a new Context with its own engine for the duration of a with block.
+  # cf/unit/profile default to those of the current Context.
+  @classmethod
+  @contextlib.contextmanager
+  def scope(cls, cf=None, unit=None, profile=None):
+
+    if cf is None: cf = cls.cf
+    if unit is None: unit = cls.unit
+    if profile is None: profile = cls.profile
+
+    context = Context(cf, unit, profile)
+    token = cls.context.set(context)
+
+    try:
+      yield context
+    finally:
+      cls.context.reset(token)
+
+# Calls fn with given args under a new scope with given cf/unit/profile, and
+# returns its result. Used to run work in worker processes, which may not
+# inherit the environment.
+def call_scoped(cf, unit, profile, fn, *args):
+  with Environment.scope(cf, unit, profile):
+    return fn(*args)
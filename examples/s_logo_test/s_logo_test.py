@@ -81,37 +81,24 @@ def ring(center, radius, width):
 
   return circ_out - circ_in
 
-# returns contour of waypoints
+# returns contour of waypoints, stroked with a square aperture so each
+# segment extends by half the width past its ends
 def contour(vectors, width):
 
   vectors = [numeric.Vector(v) for v in vectors]
-  width = numeric.Scalar(width)
-
-  radius = width / 2
-
-  block = graphic.Block()
-
-  # iterate and generate rectangles
+  width = float(numeric.Scalar(width))
 
+  # only horizontal and vertical segments are supported
   for vector_idx in range(len(vectors) - 1):
-    
+
     v1 = vectors[vector_idx]
     v2 = vectors[vector_idx + 1]
 
-    if v1[0] == v2[0]:
-      # vertical
-      center = numeric.Vector((v1[0], (v1[1] + v2[1]) / 2))
-      trace_len = numeric.Scalar(val=abs(v1[1] - v2[1]))
-      block += rect(center, width, trace_len + width)
-    elif v1[1] == v2[1]:
-      # horizontal
-      center = numeric.Vector(((v1[0] + v2[0]) / 2, v1[1]))
-      trace_len = numeric.Scalar(val=abs(v1[0] - v2[0]))
-      block += rect(center, trace_len + width, width)
-    else:
+    if not v1[0] == v2[0] and not v1[1] == v2[1]:
       raise Exception()
 
-  return block
+  return graphic.Block(
+    [graphic.Track(aperture.Rectangle(width, width), vectors)])
 
 # returns trace of waypoints with width and clearance
 def trace(vectors, width, clearance=0.):
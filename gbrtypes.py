@@ -104,6 +104,9 @@ class QuadrantMode (Renderable, Enum): pass
 class Single (QuadrantMode): pass
 class Multi (QuadrantMode): pass
 
+# Single is redefined below as a .Part attribute.
+SingleQuadrant = Single
+
 # Automatically pick based on angle x, for small value epsilon.
 # Note: if start == end, most likely client is drawing a circle or has a bug.
 # 0 <= x <= epsilon             Single, no discontinuity around 0 degrees.
@@ -473,34 +476,23 @@ class ProjectId (FileAttribute):
 
 # Must be placed immediately before EOF command.
 # Calculated from start of file to start of command, not including
-# line endings.
+# line endings. The digest is maintained by stream.Stream as commands are
+# rendered, so the file is not read back.
 class MD5 (FileAttribute):
   name = '.MD5'
 
-  # reference to containing layer
-  layer = None
-
-  def __init__(self, layer):
+  def __init__(self):
     FileAttribute.__init__(self)
-    self.layer = layer
 
-  # get current file contents from env
+  # get digest of contents rendered so far from stream
   def generate(self, stream):
 
-    import hashlib
-
-    # get handle of file being generated
-    fh = self.layer.fh
-
-    # go to beginning of file
-    fh.seek(0)
-
-    # read out entire contents so far
-    contents = ''.join([line.strip() for line in fh.readlines()])
+    if not hasattr(stream, 'hexdigest'):
+      raise Exception('MD5 requires a stream maintaining a digest')
 
     # write md5 of contents
-    md5 = hashlib.md5(contents.encode()).hexdigest()
-    self.values.append(md5)
+    md5 = stream.hexdigest()
+    self.values = [md5]
 
     logging.info('MD5: %s' % (md5))
 
@@ -897,6 +889,9 @@ class Attributes (Generator, Appendable):
 
       self.attr_objs[attr.name] = attr
 
+  def extend(self, attrs):
+    self.append(list(attrs))
+
 class FileAttributes (Attributes):
 
   attrs = [
@@ -1,4 +1,7 @@
-import logging
+import copy
+import hashlib
+import itertools
+import math
 
 from common import *
 from environment import Environment as env
@@ -6,8 +9,37 @@ import gbrtypes
 import numeric
 import command
 import aperture
+import tracing
+import cache
 
-class GraphicObject (Generator, gbrtypes.Polar):
+# Geometric transforms of graphics in terms of transform(), which returns a
+# copy transformed by a numeric.Transform. Each takes a center given as
+# Vector or tuple, defaulting to the origin.
+class Transformable:
+
+  def transform(self, transform): pass
+
+  # Rotates counterclockwise by given angle in degrees.
+  def rotate(self, angle, center=(0, 0)):
+    return self.transform(numeric.Transform(rotation=angle).centered(center))
+
+  # axis: 'X' to negate x coordinates, e.g. for bottom side layers, 'Y' to
+  #   negate y coordinates
+  def mirror(self, axis='X', center=(0, 0)):
+
+    if axis == 'X':
+      transform = numeric.Transform(mirror=True)
+    elif axis == 'Y':
+      transform = numeric.Transform(mirror=True, rotation=180.)
+    else:
+      raise Exception('Invalid mirror axis: %s' % (str(axis)))
+
+    return self.transform(transform.centered(center))
+
+  def scale(self, factor, center=(0, 0)):
+    return self.transform(numeric.Transform(scale=factor).centered(center))
+
+class GraphicObject (Generator, gbrtypes.Polar, Transformable):
 
   # Graphic attributes to associate with object.
   object_attributes = gbrtypes.ObjectAttributes
@@ -23,6 +55,56 @@ class GraphicObject (Generator, gbrtypes.Polar):
   def cleanup(self, stream):
     self.object_attributes.cleanup(stream)
 
+  # Updates given hashlib object with the data generated output depends on,
+  # for cache.RenderCache.
+  def update_digest(self, h):
+    h.update(('%s %s %s\n' % (type(self).__name__, self.polarity,
+      attribute_strs(self.object_attributes))).encode('utf-8'))
+
+# Returns sorted text of attributes in given container, for digests.
+def attribute_strs(attrs):
+  return sorted([str(attr) for attr in attrs.attr_objs.values()])
+
+# Returns aperture transform of given aperture, with given current aperture
+# transform or None, after the object is transformed by given Transform.
+def transform_aperture(ap, ap_transform, transform):
+
+  transform = transform.linear
+  if not ap_transform is None:
+    transform = transform * ap_transform
+
+  return ap.reduce_transform(transform)
+
+# Returns radius of circle containing given aperture with given aperture
+# transform or None, as canonical int.
+def aperture_radius(ap, ap_transform):
+
+  radius = ap.radius()
+  if not ap_transform is None:
+    radius = int(math.ceil(radius * ap_transform.scale))
+
+  return radius
+
+# Returns given bounds expanded by given margin, or None if None.
+def expand_bounds(bounds, margin):
+
+  if bounds is None:
+    return None
+
+  return (bounds[0] - margin, bounds[1] - margin, bounds[2] + margin,
+    bounds[3] + margin)
+
+# Returns bounds containing each of given bounds, skipping None, or None if
+# there are none.
+def union_bounds(bounds):
+
+  bounds = [val for val in bounds if not val is None]
+  if len(bounds) == 0:
+    return None
+
+  return (min([val[0] for val in bounds]), min([val[1] for val in bounds]),
+    max([val[2] for val in bounds]), max([val[3] for val in bounds]))
+
 # 2-dimensional line segment with no width. Only used to construct a Region.
 class Segment (Generator):
 
@@ -44,72 +126,122 @@ class Segment (Generator):
 
   def generate(self, stream):
 
-    # set interpolation
-    env.engine.set_interp(stream, self.interp_mode, self.center)
-
-    # set quadrant mode
-    env.engine.set_quad(stream, self.quad_mode)
+    arc = None
+    if issubclass(type(self.interp_mode), gbrtypes.Circular):
+      arc = (self.interp_mode, self.quad_mode,
+        numeric.Vector.quantize(self.center))
 
-    # ensure current vector is at start
-    env.engine.move(stream, self.vectors[0])
+    env.engine.edge(stream, self.vectors[0].fixed, self.vectors[1].fixed, arc)
 
-    # create linear segment
-    env.engine.interpolate(stream, self.vectors[1])
-
-# Builds list of segments with region mode on.
+# Builds chain of segments with region mode on. Segments are stored as a
+# numeric.Contour rather than as individual Segment objects.
 class Region (GraphicObject):
 
   # Aperture attributes to associate with object.
   aperture_attributes = gbrtypes.ApertureAttributes
 
-  # list of Segment objects
-  segments = list
+  # Contour holding vertices of segments.
+  contour = numeric.Contour
+
+  # Sequence number, used to identify region in output independent of
+  # memory layout so output is reproducible.
+  index = int
+  indices = itertools.count()
 
+  # segments: one of:
+  #   list of Segment objects
+  #   list of Vectors/tuples, forming a closed polygon
+  #   numeric.Contour
+  #   object supporting buffer protocol with x/y pairs, forming a closed
+  #     polygon; int64 data is used without copying
   def __init__(self, segments=list(), polarity=None):
     GraphicObject.__init__(self, polarity)
 
     self.aperture_attributes = gbrtypes.ApertureAttributes()
-    self.segments = list()
-
-    # normalize segments to form closed region
-    if len(segments) > 0:
-
-      if type(segments[0]) is Segment:
-
-        # append given segments
-        self.segments += segments
+    self.index = next(Region.indices)
 
+    if type(segments) is numeric.Contour:
+      self.contour = segments
+    elif type(segments) is list or type(segments) is tuple:
+      if len(segments) > 0 and type(segments[0]) is Segment:
+        self.contour = numeric.Contour.from_segments(segments)
       else:
-
         # assemble simple polygon from vectors
-        vectors = segments
-
-        # normalize vectors
-        vectors = [numeric.Vector(vector) for vector in vectors]
-
-        for idx in range(len(vectors) - 1):
-          self.segments.append(Segment((vectors[idx], vectors[idx + 1])))
+        self.contour = numeric.Contour.from_vectors(segments)
+    else:
+      self.contour = numeric.Contour.from_buffer(segments)
+
+  # Tuple of Segment objects, created on demand from contour. Read-only:
+  # segments are not stored, so change the region by replacing contour.
+  @property
+  def segments(self):
+
+    segments = list()
+    for start, end, arc in self.contour.edges():
+      start = numeric.Vector.from_fixed(start)
+      end = numeric.Vector.from_fixed(end)
+
+      if arc is None:
+        segments.append(Segment((start, end)))
+      else:
+        interp_mode, quad_mode, center = arc
+        segments.append(Segment((start, end), interp_mode, quad_mode,
+          numeric.Vector.from_fixed(center)))
 
-        # closing segment
-        self.segments.append(Segment((vectors[-1], vectors[0])))
+    return tuple(segments)
 
   # Map addition/subtraction to Block creation.
   def __add__(self, other): return Block([self, other])
 
   def __sub__(self, other): return self + other.invert()
 
-  def __str__(self): return 'R%08X' % (id(self))
+  def __str__(self): return 'R%08X' % (self.index)
+
+  # Returns copy of region offset by given Vector or tuple.
+  def translate(self, vector):
+    ret = copy.copy(self)
+    ret.contour = self.contour.translate(numeric.Vector.quantize(vector))
+    ret.index = next(Region.indices)
+    return ret
+
+  # Returns copy of region transformed by given numeric.Transform.
+  def transform(self, transform):
+    ret = copy.copy(self)
+    ret.contour = self.contour.transform(transform)
+    ret.index = next(Region.indices)
+    return ret
+
+  # Removes redundant vertices of straight edges, e.g. repeated or collinear
+  # after quantization, without changing the image. Returns number of
+  # vertices removed.
+  def simplify(self):
+    self.contour, count = self.contour.simplify()
+    return count
+
+  # Returns (x_min, y_min, x_max, y_max) as canonical ints, or None if
+  # empty. Bounds of graphics contain their image but may not be tight,
+  # e.g. arcs are bounded by their full circle.
+  def bounds(self):
+    return self.contour.bounds()
+
+  # Region index only appears in comments, so is not part of the digest.
+  def update_digest(self, h):
+    GraphicObject.update_digest(self, h)
+    h.update(str(attribute_strs(self.aperture_attributes)).encode('utf-8'))
+    self.contour.update_digest(h)
 
   def generate(self, stream):
     GraphicObject.generate(self, stream)
 
-    logging.info('Generating region: ' + str(self))
+    if tracing.enabled:
+      tracing.trace('region', 'Generating region: %s', self)
 
     # reset graphics state
     env.engine.state.reset()
 
     # comment
-    stream.append(command.Comment('Region: ' + str(self)))
+    if env.profile.comments:
+      stream.append(command.Comment('Region: ' + str(self)))
 
     # add aperture attributes
     self.aperture_attributes.generate(stream)
@@ -121,10 +253,11 @@ class Region (GraphicObject):
     stream.append(command.StartRegion())
 
     # generate segments
-    [segment.generate(stream) for segment in self.segments]
+    env.engine.contour(stream, self.contour)
 
     # generate final D02
-    stream.append(command.Move(env.engine.state.vector))
+    stream.append(command.Move(val=env.engine.state.vector,
+      prev=env.engine.state.vector))
 
     # turn region mode off
     stream.append(command.EndRegion())
@@ -138,23 +271,215 @@ class FlashObject (GraphicObject):
   ap = aperture.Aperture
   vector = numeric.Vector
 
+  # Linear numeric.Transform of aperture loaded by LM/LR/LS, or None.
+  ap_transform = numeric.Transform
+
   def __init__(self, ap, vector, polarity=None):
     GraphicObject.__init__(self, polarity)
 
     self.ap = ap
     self.vector = vector
+    self.ap_transform = None
 
   def __str__(self):
     return 'Flash of %s at %s' % (self.ap.d_code, str(self.vector))
 
+  # Returns copy of flash offset by given Vector or tuple.
+  def translate(self, vector):
+    val = numeric.Vector.quantize(self.vector)
+    offset = numeric.Vector.quantize(vector)
+
+    ret = copy.copy(self)
+    ret.vector = numeric.Vector.from_fixed(
+      (val[0] + offset[0], val[1] + offset[1]))
+    return ret
+
+  # Returns copy of flash transformed by given numeric.Transform, with its
+  # aperture transformed about the flash position.
+  def transform(self, transform):
+    ret = copy.copy(self)
+    ret.vector = numeric.Vector.from_fixed(
+      transform.apply(numeric.Vector.quantize(self.vector)))
+    ret.ap_transform = transform_aperture(self.ap, self.ap_transform,
+      transform)
+    return ret
+
+  def bounds(self):
+    x, y = numeric.Vector.quantize(self.vector)
+    return expand_bounds((x, y, x, y),
+      aperture_radius(self.ap, self.ap_transform))
+
+  def update_digest(self, h):
+    GraphicObject.update_digest(self, h)
+    h.update(('%s %d %d %s\n' % ((self.ap.d_code,) +
+      numeric.Vector.quantize(self.vector) + (self.ap_transform,))).encode(
+      'utf-8'))
+
   def generate(self, stream):
     GraphicObject.generate(self, stream)
 
+    env.engine.set_polarity(stream, self.polarity)
+    env.engine.set_transform(stream, self.ap_transform)
     env.engine.flash(stream, self.ap, self.vector)
 
-# Helper abstraction for a list of regions/flashes with basic 
+# Aperture flashed at each of an array of points, e.g. vias or a BGA
+# footprint, without an object per point.
+class FlashArray (GraphicObject):
+
+  ap = aperture.Aperture
+
+  # Point array of canonical ints, see numeric.points_from_buffer().
+  points = None
+
+  # Linear numeric.Transform of aperture loaded by LM/LR/LS, or None.
+  ap_transform = numeric.Transform
+
+  # points: list of Vectors/tuples, or object supporting the buffer protocol
+  #   with x/y pairs, e.g. array.array or an N x 2 ndarray
+  def __init__(self, ap, points, polarity=None):
+    GraphicObject.__init__(self, polarity)
+
+    if type(points) is list:
+      points = numeric.points_from_vectors(points)
+    else:
+      points = numeric.points_from_buffer(points)
+
+    self.ap = ap
+    self.points = points
+    self.ap_transform = None
+
+  def __len__(self):
+    return len(self.points) // 2
+
+  def __str__(self):
+    return 'Flash array of %s at %d points' % (self.ap.d_code, len(self))
+
+  def __getstate__(self):
+
+    state = dict(self.__dict__)
+    state['points'] = numeric.points_array(self.points)
+    return state
+
+  # Returns copy of flash array offset by given Vector or tuple.
+  def translate(self, vector):
+
+    ret = copy.copy(self)
+    ret.points = numeric.translate_points(
+      self.points, numeric.Vector.quantize(vector))
+    return ret
+
+  # Returns copy of flash array transformed by given numeric.Transform.
+  def transform(self, transform):
+    ret = copy.copy(self)
+    ret.points = transform.apply_points(self.points)
+    ret.ap_transform = transform_aperture(self.ap, self.ap_transform,
+      transform)
+    return ret
+
+  def bounds(self):
+
+    if len(self) == 0:
+      return None
+
+    xs = self.points[0::2]
+    ys = self.points[1::2]
+    return expand_bounds((min(xs), min(ys), max(xs), max(ys)),
+      aperture_radius(self.ap, self.ap_transform))
+
+  def update_digest(self, h):
+    GraphicObject.update_digest(self, h)
+    h.update(('%s %d %s\n' % (self.ap.d_code, len(self.points),
+      self.ap_transform)).encode('utf-8'))
+    h.update(self.points)
+
+  def generate(self, stream):
+    GraphicObject.generate(self, stream)
+
+    env.engine.set_polarity(stream, self.polarity)
+    env.engine.set_transform(stream, self.ap_transform)
+    env.engine.flash_array(stream, self.ap, self.points)
+
+# Stroke of a chain of segments drawn with D01 using a Circle or Rectangle
+# aperture, e.g. a trace. Segments are stored as an open numeric.Contour.
+class Track (GraphicObject):
+
+  ap = aperture.Aperture
+
+  # Contour holding vertices of segments.
+  contour = numeric.Contour
+
+  # Linear numeric.Transform of aperture loaded by LM/LR/LS, or None.
+  ap_transform = numeric.Transform
+
+  # segments: one of:
+  #   list of Segment objects
+  #   list of Vectors/tuples, forming a polyline
+  #   numeric.Contour
+  #   object supporting buffer protocol with x/y pairs, forming a polyline;
+  #     int64 data is used without copying
+  def __init__(self, ap, segments, polarity=None):
+    GraphicObject.__init__(self, polarity)
+
+    if type(segments) is numeric.Contour:
+      contour = segments
+    elif type(segments) is list or type(segments) is tuple:
+      if len(segments) > 0 and type(segments[0]) is Segment:
+        contour = numeric.Contour.from_segments(segments)
+      else:
+        contour = numeric.Contour.from_vectors(segments, closed=False)
+    else:
+      contour = numeric.Contour.from_buffer(segments, closed=False)
+
+    # only solid circles and rectangles may be stroked, rectangles only
+    # along straight segments
+    if not type(ap) in (aperture.Circle, aperture.Rectangle) or \
+      not ap.hole is None:
+      raise Exception('Track requires solid Circle or Rectangle aperture: ' +
+        str(ap))
+    if type(ap) is aperture.Rectangle and len(contour.arcs) > 0:
+      raise Exception('Track with Rectangle aperture must not contain arcs')
+
+    self.ap = ap
+    self.contour = contour
+    self.ap_transform = None
+
+  def __str__(self):
+    return 'Track of %s, %d vertices' % (self.ap.d_code, len(self.contour))
+
+  # Returns copy of track offset by given Vector or tuple.
+  def translate(self, vector):
+    ret = copy.copy(self)
+    ret.contour = self.contour.translate(numeric.Vector.quantize(vector))
+    return ret
+
+  # Returns copy of track transformed by given numeric.Transform.
+  def transform(self, transform):
+    ret = copy.copy(self)
+    ret.contour = self.contour.transform(transform)
+    ret.ap_transform = transform_aperture(self.ap, self.ap_transform,
+      transform)
+    return ret
+
+  def bounds(self):
+    return expand_bounds(self.contour.bounds(),
+      aperture_radius(self.ap, self.ap_transform))
+
+  def update_digest(self, h):
+    GraphicObject.update_digest(self, h)
+    h.update(('%s %s\n' % (self.ap.d_code, self.ap_transform)).encode(
+      'utf-8'))
+    self.contour.update_digest(h)
+
+  def generate(self, stream):
+    GraphicObject.generate(self, stream)
+
+    env.engine.set_polarity(stream, self.polarity)
+    env.engine.set_transform(stream, self.ap_transform)
+    env.engine.track(stream, self.ap, self.contour)
+
+# Helper abstraction for a list of regions/flashes/tracks with basic 
 # arithmetic operations indicating polarity.
-class Block (Generator, Appendable):
+class Block (Generator, Appendable, Transformable):
 
   object_attributes = gbrtypes.ObjectAttributes
   aperture_attributes = gbrtypes.ApertureAttributes
@@ -164,6 +489,7 @@ class Block (Generator, Appendable):
   # objects by category
   regions = list
   flashes = list
+  tracks = list
 
   def __init__(self, objects=list()):
 
@@ -175,10 +501,13 @@ class Block (Generator, Appendable):
     self.objects = list()
     self.regions = list()
     self.flashes = list()
+    self.tracks = list()
 
     Appendable.__init__(self, [
-      (Region, self.regions, self.append_region),
-      (FlashObject, self.flashes, self.append_flash),
+      (Region, self.regions, self.append_region, self.append_regions),
+      ((FlashObject, FlashArray), self.flashes, self.append_flash,
+        self.append_flashes),
+      (Track, self.tracks, self.append_flash, self.append_flashes),
       (Block, None, self.append_block),
       (gbrtypes.ObjectAttributes, None, self.append_obj_attr),
       (gbrtypes.ApertureAttributes, None, self.append_ap_attr),
@@ -205,6 +534,48 @@ class Block (Generator, Appendable):
 
   def __str__(self): return 'B%08X' % (id(self))
 
+  # Returns new block with all objects offset by given Vector or tuple.
+  def translate(self, vector):
+    return self.map(lambda obj: obj.translate(vector))
+
+  # Returns new block with all objects transformed by given
+  # numeric.Transform.
+  def transform(self, transform):
+    return self.map(lambda obj: obj.transform(transform))
+
+  # Returns new block with objects returned by given function of each object.
+  def map(self, fn):
+
+    block = Block()
+    block.object_attributes = self.object_attributes
+    block.aperture_attributes = self.aperture_attributes
+
+    for obj in self.objects:
+      obj = fn(obj)
+      block.objects.append(obj)
+
+      if issubclass(type(obj), Region):
+        block.regions.append(obj)
+      elif issubclass(type(obj), Track):
+        block.tracks.append(obj)
+      else:
+        block.flashes.append(obj)
+
+    return block
+
+  def bounds(self):
+    return union_bounds([obj.bounds() for obj in self.objects])
+
+  # Returns digest of objects in local coordinates, identifying the output
+  # generated by this block in a given environment.
+  def digest(self):
+
+    h = hashlib.md5()
+    for obj in self.objects:
+      obj.update_digest(h)
+
+    return h.digest()
+
   # todo: refactor attribute handling
 
   def append_region(self, region):
@@ -216,14 +587,27 @@ class Block (Generator, Appendable):
     region.object_attributes = self.object_attributes
     self.objects.append(region)
 
+  def append_regions(self, regions):
+    for region in regions:
+      region.object_attributes = self.object_attributes
+      region.aperture_attributes = self.aperture_attributes
+    self.objects.extend(regions)
+
+  def append_flashes(self, flashes):
+    for flash in flashes:
+      flash.object_attributes = self.object_attributes
+    self.objects.extend(flashes)
+
+  # Objects of nested block are appended in their original order, since
+  # order of different polarities is significant.
   def append_block(self, block):
-    self.append(block.regions)
-    self.append(block.flashes)
+    self.append(block.objects)
 
   def append_obj_attr(self, attr):
     self.object_attributes = attr
     [region.append(attr) for region in self.regions]
     [flash.append(attr) for flash in self.flashes]
+    [track.append(attr) for track in self.tracks]
 
   def append_ap_attr(self, attr):
     self.aperture_attributes = attr
@@ -233,9 +617,184 @@ class Block (Generator, Appendable):
     for flash in self.flashes:
       region.aperture_attributes = attr
 
+    # attributes of a stroke belong to its aperture
+    annotated = dict()
+    for track in self.tracks:
+      if not id(track.ap) in annotated:
+        annotated[id(track.ap)] = track.ap.annotate(attr)
+      track.ap = annotated[id(track.ap)]
+
   def generate(self, stream):
 
-    logging.debug('Generating block %s: %d regions, %d flashes' % (
-      str(self), len(self.regions), len(self.flashes)))
+    if tracing.enabled:
+      tracing.trace('block',
+        'Generating block %s: %d regions, %d flashes, %d tracks', self,
+        len(self.regions), len(self.flashes), len(self.tracks))
 
     for obj in self.objects: obj.generate(stream)
+
+# Places a Block, given in local coordinates, at an offset. The block is
+# rendered once into the render cache of the environment, shared by all
+# instances of identical geometry, and each instance adds its offset to the
+# cached coordinates. Unlike StepRepeat, modal state is kept across the
+# instance.
+class Instance (Generator):
+
+  block = Block
+
+  # Offset as canonical tuple of ints.
+  offset = tuple
+
+  def __init__(self, block, offset):
+
+    self.block = block
+    self.offset = numeric.Vector.quantize(offset)
+
+  def __str__(self): return 'I%08X' % (id(self))
+
+  # Flashes and tracks of block, for aperture assignment.
+  @property
+  def flashes(self): return self.block.flashes
+  @property
+  def tracks(self): return self.block.tracks
+
+  def bounds(self):
+
+    bounds = self.block.bounds()
+    if bounds is None:
+      return None
+
+    x, y = self.offset
+    return (bounds[0] + x, bounds[1] + y, bounds[2] + x, bounds[3] + y)
+
+  # Returns copy of instance offset by given Vector or tuple.
+  def translate(self, vector):
+    offset = numeric.Vector.quantize(vector)
+    return Instance(self.block, numeric.Vector.from_fixed(
+      (self.offset[0] + offset[0], self.offset[1] + offset[1])))
+
+  def generate(self, stream):
+
+    fragment = env.cache.fragment(self.block)
+
+    # fragment is generated with no aperture transformation loaded
+    env.engine.set_transform(stream, None)
+
+    if not fragment.empty:
+      stream.append(cache.Placement(fragment, self.offset))
+
+    env.engine.state = fragment.place_state(self.offset)
+
+# Places copies of a Block, given in local coordinates, at a list of
+# positions. If positions form a regular grid, a single step and repeat (SR)
+# block is generated; otherwise each copy is generated individually.
+class StepRepeat (Generator):
+
+  block = Block
+
+  # Positions as canonical tuples of ints.
+  positions = list
+
+  # Decimal places of step distances.
+  precision = 6
+
+  def __init__(self, block, positions):
+
+    self.block = block
+    self.positions = [numeric.Vector.quantize(v) for v in positions]
+
+  # Creates regular grid of count = (x_count, y_count) copies separated by
+  # step = (x_step, y_step), starting at origin.
+  @classmethod
+  def grid(cls, block, origin, count, step):
+
+    origin = numeric.Vector.quantize(origin)
+    step = numeric.Vector.quantize(step)
+
+    positions = list()
+    for y in range(count[1]):
+      for x in range(count[0]):
+        positions.append(numeric.Vector.from_fixed(
+          (origin[0] + x * step[0], origin[1] + y * step[1])))
+
+    return cls(block, positions)
+
+  def __str__(self): return 'S%08X' % (id(self))
+
+  # Flashes and tracks of block, for aperture assignment.
+  @property
+  def flashes(self): return self.block.flashes
+  @property
+  def tracks(self): return self.block.tracks
+
+  def bounds(self):
+
+    bounds = self.block.bounds()
+    if bounds is None or len(self.positions) == 0:
+      return None
+
+    xs = [val[0] for val in self.positions]
+    ys = [val[1] for val in self.positions]
+    return (bounds[0] + min(xs), bounds[1] + min(ys), bounds[2] + max(xs),
+      bounds[3] + max(ys))
+
+  # Returns (origin, count, step) as tuples of ints if positions form a
+  # regular grid, otherwise None.
+  def lattice(self):
+
+    if len(self.positions) == 0:
+      return None
+
+    xs = sorted(set([v[0] for v in self.positions]))
+    ys = sorted(set([v[1] for v in self.positions]))
+
+    # every grid point must be present exactly once
+    if len(xs) * len(ys) != len(self.positions) or \
+      len(set(self.positions)) != len(self.positions):
+      return None
+
+    step = list()
+    for vals in (xs, ys):
+      diffs = set([vals[idx + 1] - vals[idx] for idx in range(len(vals) - 1)])
+      if len(diffs) > 1:
+        return None
+      step.append(diffs.pop() if len(diffs) > 0 else 0)
+
+    return ((xs[0], ys[0]), (len(xs), len(ys)), tuple(step))
+
+  def generate(self, stream):
+
+    lattice = self.lattice()
+
+    # copies do not depend on modal state set before
+    env.engine.state.reset()
+
+    if lattice is None:
+
+      if tracing.enabled:
+        tracing.trace('step_repeat', 'Step and repeat %s: expanding %d copies',
+          self, len(self.positions))
+
+      for position in self.positions:
+        self.block.translate(
+          numeric.Vector.from_fixed(position)).generate(stream)
+
+    else:
+
+      origin, count, step = lattice
+      scale = float(env.codec.scale)
+
+      # each copy starts with the aperture transformation the block ends
+      # with, so use the same at both
+      env.engine.set_transform(stream, None)
+
+      stream.append(command.StepRepeat(count[0], count[1],
+        step[0] / scale, step[1] / scale, self.precision))
+
+      self.block.translate(numeric.Vector.from_fixed(origin)).generate(stream)
+
+      env.engine.set_transform(stream, None)
+      stream.append(command.StepRepeat())
+
+    # current point and modes are undefined after block
+    env.engine.state.reset()
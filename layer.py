@@ -1,5 +1,7 @@
 import datetime
+import gzip
 import logging
+import os
 
 from common import *
 from environment import Environment as env
@@ -7,32 +9,57 @@ import gbrtypes
 import command
 import aperture
 import graphic
+import stream
+import tracing
+import ordering
+import spatial
+import drc
 
 class Layer (Generator, Appendable):
 
   # attributes
   attributes = gbrtypes.FileAttributes
 
-  # list of apertures defined by user
+  # list of apertures defined in this layer, one per D-code
   apertures = list
+
+  # assigns D-codes, may be shared with other layers
+  registry = aperture.Registry
+
+  # D-codes of apertures defined in this layer
+  d_codes = set
   
   # graphics objects
   graphics = list
 
-  # file handle set during generation of output file
-  fh = None
+  # whether to generate runs of flashes and tracks of the same polarity
+  # grouped by aperture, minimizing aperture selections; graphics are not
+  # modified
+  group_apertures = bool
+
+  # spatial.GridIndex of graphics, maintained as they are added once enabled
+  # by build_index(); None if not enabled
+  index = None
+
+  # registry: aperture.Registry to share D-codes with other layers, e.g.
+  #   all layers of a board; if None, a registry for this layer is created
+  def __init__(self, polarity, project_id, registry=None):
 
-  def __init__(self, polarity, project_id):
+    if registry is None: registry = aperture.Registry()
 
     self.attributes = gbrtypes.FileAttributes()
     self.apertures = list()
     self.graphics = list()
+    self.registry = registry
+    self.d_codes = set()
+    self.group_apertures = False
+    self.index = None
 
     Appendable.__init__(self, [
       (gbrtypes.FileAttribute, self.attributes, None),
-      (aperture.Aperture, self.apertures, self.append_aperture),
-      (Generator, self.graphics, self.append_graphic),
-      (Renderable, self.graphics, self.append_graphic)
+      (aperture.Aperture, None, self.append_aperture),
+      (Generator, self.graphics, self.append_graphic, self.append_graphics),
+      (Renderable, self.graphics, self.append_graphic, self.append_graphics)
     ])
 
     # append common attributes
@@ -45,139 +72,292 @@ class Layer (Generator, Appendable):
   def __str__(self):
     return 'L%08X' % (id(self))
 
-  # Callback invoked when aperture object is added.
+  # Callback invoked when aperture object is added. Identical apertures are
+  # interned to a single D-code. Returns canonical aperture.
   def append_aperture(self, ap):
 
-    # subtract 1 to start with 0 since aperture already appended
-    ap.assign(aperture.DNN_BASE + len(self.apertures) - 1)
-    logging.info('Layer %s: Assigned aperture: %s' % (str(self), str(ap)))
+    ap = self.registry.intern(ap)
+
+    if not ap.index in self.d_codes:
+
+      # apertures used by a block aperture must be defined first
+      if hasattr(ap, 'flashes'):
+        self.append_nested(ap)
+
+      self.d_codes.add(ap.index)
+      self.apertures.append(ap)
+      if tracing.enabled:
+        tracing.trace('aperture', 'Layer %s: Assigned aperture: %s', self, ap)
+
+    return ap
+
+  # Returns canonical aperture for given aperture of a graphic, defining it
+  # if needed. Apertures identical to one already defined in this layer are
+  # replaced by it without being assigned themselves, so they can be freed.
+  def define_aperture(self, ap):
+
+    canonical = self.registry.lookup(ap)
+    if canonical is None or not canonical.index in self.d_codes:
+      canonical = self.append_aperture(ap)
+
+    return canonical
 
   # Callback invoked when graphic object is added.
   def append_graphic(self, obj):
 
-    # make sure aperture is assigned, if applicable
+    # make sure apertures are defined, if applicable
     if hasattr(obj, 'ap'):
-      if not obj.ap.assigned:
-        self.append(obj.ap)
+      obj.ap = self.define_aperture(obj.ap)
+    if hasattr(obj, 'flashes'):
+      self.append_nested(obj)
+
+    if not self.index is None:
+      self.index.insert(obj)
+
+    if tracing.enabled:
+      tracing.trace('graphic', 'Layer %s: Added graphic: %s', self, obj)
+
+  # Defines apertures of flashes and tracks of given block, block aperture
+  # or step and repeat.
+  def append_nested(self, obj):
+    for nested in obj.flashes + obj.tracks:
+      nested.ap = self.append_aperture(nested.ap)
+
+  # Callback invoked when graphic objects of the same class are added in
+  # bulk. Consecutive objects typically share an aperture object, which is
+  # defined once per run.
+  def append_graphics(self, objs):
+
+    # last aperture given and its canonical aperture
+    last = None
+    canonical = None
+
+    # objects are of the same class, so check attributes once
+    has_ap = hasattr(objs[0], 'ap')
+    has_flashes = hasattr(objs[0], 'flashes')
+
+    for obj in objs:
+      if has_ap:
+        if not obj.ap is last:
+          last = obj.ap
+          canonical = self.define_aperture(last)
+        obj.ap = canonical
+      if has_flashes:
+        self.append_nested(obj)
+
+    if not self.index is None:
+      self.index.extend(objs)
+
+    if tracing.enabled:
+      for obj in objs:
+        tracing.trace('graphic', 'Layer %s: Added graphic: %s', self, obj)
+
+  # Reorders runs of flashes and tracks of the same polarity to shorten the
+  # path travelled between them, without changing the image.
+  # Returns (before, after) total travel in units.
+  def optimize_travel(self):
+
+    before = ordering.travel(self.graphics)
+    self.graphics[:] = ordering.order(self.graphics)
+    after = ordering.travel(self.graphics)
+
+    # reordered runs may be new objects
+    if not self.index is None:
+      self.index.rebuild(self.graphics)
+
+    if tracing.enabled:
+      tracing.trace('travel', 'Layer %s: Travel %.3f -> %.3f', self, before,
+        after)
+
+    return (before, after)
+
+  # Enables spatial index of graphics, indexing those already added.
+  # cell: side of grid cells as Vector component; if None, chosen from the
+  #   size of graphics already added
+  # Returns spatial.GridIndex.
+  def build_index(self, cell=None):
+
+    self.index = spatial.GridIndex(cell)
+    self.index.extend(self.graphics)
+
+    return self.index
+
+  # Checks design rules, see drc.check(). Returns list of drc.Violations.
+  def check(self, clearance=None, width=None, annular=None, processes=1,
+    tile=None):
+    return drc.check(self, clearance, width, annular, processes, tile)
+
+  # stats: stream.Stats to time each phase into, or None
+  def generate(self, stream, stats=None):
+
+    if tracing.enabled:
+      self.trace_counts()
+
+    # generate within a new scope so this run has its own engine and modal
+    # state, independent of other layers generated concurrently
+    with env.scope():
+      for name, phase in self.phases():
+        if stats is None:
+          phase(stream)
+        else:
+          with stats.phase(name, stream):
+            phase(stream)
 
-    logging.info('Layer %s: Added graphic: %s' % (str(self), str(obj)))
+      if not stats is None:
+        stats.suppressed = env.engine.suppressed
 
-  def generate(self, stream):
+  # Trace info about graphics objects to be generated.
+  def trace_counts(self):
 
     block_count = 0
     region_count = 0
     flash_count = 0
+    track_count = 0
     other_count = 0
 
-    # print info about graphics objects to be generated
     for obj in self.graphics:
       if issubclass(type(obj), graphic.Block):
         block_count += 1
         region_count += len(obj.regions)
       elif issubclass(type(obj), graphic.Region):
         region_count += 1
-      elif issubclass(type(obj), graphic.FlashObject):
+      elif issubclass(type(obj), (graphic.FlashObject, graphic.FlashArray)):
         flash_count += 1
+      elif issubclass(type(obj), graphic.Track):
+        track_count += 1
       else:
         other_count += 1
 
-    gen_count = block_count + region_count + flash_count + other_count
+    gen_count = block_count + region_count + flash_count + track_count + \
+      other_count
+
+    tracing.trace('layer',
+      'Layer %s: Generating %d apertures, %d objects (%d blocks, %d regions, '
+        '%d flashes, %d tracks, %d other)', self, len(self.apertures),
+        gen_count, block_count, region_count, flash_count, track_count,
+        other_count)
+
+  # Returns (name, function) of each phase of generation, in order.
+  # Functions take the stream to generate into.
+  def phases(self):
+    return [
+      ('attributes', self.generate_attributes),
+      ('apertures', self.generate_apertures),
+      ('graphics', self.generate_graphics),
+      ('footer', self.generate_footer),
+    ]
+
+  def generate_attributes(self, stream):
 
     # generate header info
     stream.append(command.SetCoordinateFormat(env.cf))
     stream.append(command.SetUnit(env.unit))
 
-    # generate attributes
     self.attributes.generate(stream)
 
-    # generate aperture definitions
+  def generate_apertures(self, stream):
     for ap in self.apertures:
       ap.generate(stream)
       ap.cleanup(stream)
 
-    # generate graphics objects
-    for obj in self.graphics:
+  def generate_graphics(self, stream):
+
+    graphics = self.graphics
+    if self.group_apertures:
+      graphics = ordering.group(graphics)
+
+    for obj in graphics:
       obj.generate(stream)
       obj.cleanup(stream)
 
-    # write footer
-    stream.append(gbrtypes.MD5(self))
+  def generate_footer(self, stream):
+    stream.append(gbrtypes.MD5())
     stream.append(command.EOF())
 
-    logging.info(
-      'Layer %s: Generated %d apertures, %d objects (%d blocks, %d regions, '
-        '%d flashes, %d other)' % (
-        str(self), len(self.apertures), gen_count, block_count, 
-        region_count, flash_count, other_count))
-
-  def write(self, file):
-
-    # create new list
-    stream = list()
-
-    # open output file and set reference in current layer
-    fh = open(file, 'w+')
-    self.fh = fh
-
-    # generate self
-    self.generate(stream)
-
-    for cmd in stream:
-
-      # recursively expand into renderable commands and write
-      def expand(cmd):
-
-        if issubclass(type(cmd), Renderable):
-          fh.write(cmd.render() + '\n')
-        elif issubclass(type(cmd), Generator):
-          gen_list = list()
-          cmd.generate(gen_list)
-          [expand(gen) for gen in gen_list]
-        else:
-          raise Exception('Command not renderable: %s' % (str(cmd)))
-
-      expand(cmd)
-
-    fh.close()
-    self.fh = None
-
-    logging.info('Wrote "%s", %d commands' % (file, len(stream)))
+  # Render layer into given file path or file-like object. Commands are
+  # rendered as they are generated, so memory use does not depend on the
+  # number of graphics objects. Paths ending in .gz are written compressed,
+  # with compression on a worker thread. If generation fails, a file opened
+  # at given path is closed and removed.
+  # profile: environment.Profile to render with; defaults to that of the
+  #   current environment
+  # Returns stream.Stats of the time spent in each phase and output counters.
+  def write(self, file, profile=None):
+
+    # open output file
+    if type(file) is str and file.endswith('.gz'):
+      fh = stream.ThreadedSink(gzip.open(file, 'wb'))
+    elif type(file) is str:
+      fh = open(file, 'w', encoding='utf-8')
+    else:
+      fh = file
+
+    # generate self, rendering into file
+    stats = stream.Stats()
+    out = stream.Stream(fh)
+
+    try:
+      with env.scope(profile=profile):
+        self.generate(out, stats)
+
+        # render lines still buffered
+        with stats.phase('flush', out):
+          out.flush()
+
+    except Exception:
+      # don't leave a truncated file behind
+      if type(file) is str:
+        fh.close()
+        os.remove(file)
+      raise
+
+    finally:
+      if type(file) is str:
+        fh.close()
+
+    stats.collect(out)
+
+    logging.info('Wrote "%s": %s' % (str(file), str(stats)))
+
+    return stats
 
 class OutlineLayer (Layer):
 
-  def __init__(self, project_id=None):
-    Layer.__init__(self, gbrtypes.Positive(), project_id)
+  def __init__(self, project_id=None, registry=None):
+    Layer.__init__(self, gbrtypes.Positive(), project_id, registry)
     self.append(gbrtypes.Profile())
 
 class CopperLayer (Layer):
 
   def __init__(self, index, side=gbrtypes.Side.TOP, layertype=None,
-    project_id=None):
-    Layer.__init__(self, gbrtypes.Positive(), project_id)
+    project_id=None, registry=None):
+    Layer.__init__(self, gbrtypes.Positive(), project_id, registry)
     self.append(gbrtypes.Copper(index, side, layertype))
 
 class PlatedDrill (Layer):
 
   def __init__(self, index_from, index_to, pth_span, label=None, 
-    project_id=None):
-    Layer.__init__(self, gbrtypes.Positive(), project_id)
+    project_id=None, registry=None):
+    Layer.__init__(self, gbrtypes.Positive(), project_id, registry)
     self.append(gbrtypes.Plated(index_from, index_to, pth_span, label))
 
 class NonPlatedDrill (Layer):
 
   def __init__(self, index_from, index_to, npth_span, label=None, 
-    project_id=None):
-    Layer.__init__(self, gbrtypes.Positive(), project_id)
+    project_id=None, registry=None):
+    Layer.__init__(self, gbrtypes.Positive(), project_id, registry)
     self.append(gbrtypes.NonPlated(index_from, index_to, npth_span, label))
 
 class Soldermask (Layer):
 
-  def __init__(self, side=gbrtypes.Side.TOP, index=None, project_id=None):
-    Layer.__init__(self, gbrtypes.Negative(), project_id)
+  def __init__(self, side=gbrtypes.Side.TOP, index=None, project_id=None,
+    registry=None):
+    Layer.__init__(self, gbrtypes.Negative(), project_id, registry)
     self.append(gbrtypes.Soldermask(side, index))
 
 class Silkscreen (Layer):
 
-  def __init__(self, side=gbrtypes.Side.TOP, index=None, project_id=None):
-    Layer.__init__(self, gbrtypes.Positive(), project_id)
+  def __init__(self, side=gbrtypes.Side.TOP, index=None, project_id=None,
+    registry=None):
+    Layer.__init__(self, gbrtypes.Positive(), project_id, registry)
     self.append(gbrtypes.Legend(side, index))
@@ -1,5 +1,115 @@
+import array
+import math
+
 from common import *
 from environment import Environment as env
+import gbrtypes
+
+# ------------------------------------------------------------------------------
+# Converts floats to canonical ints and canonical ints to coordinate text for
+# a given CoordinateFormat. Built once per format and reused for all values.
+# ------------------------------------------------------------------------------
+class Codec:
+
+  # Codec objects by (int_len, dec_len, compact).
+  codecs = dict()
+
+  cf = gbrtypes.CoordinateFormat
+
+  # Whether leading zeros and coordinates equal to the current point are
+  # omitted.
+  compact = bool
+
+  # Multiplier from float value to canonical int.
+  scale = int
+
+  # Formats for non-negative and negative values, zero-padded to full length
+  # unless compact.
+  fmt = str
+  fmt_neg = str
+
+  # Formats for pairs of non-negative values by prefix.
+  fmt_pair = dict
+
+  def __init__(self, cf, compact=False):
+
+    self.cf = cf
+    self.compact = compact
+    self.scale = 10 ** cf.dec_len
+
+    digits = cf.int_len + cf.dec_len
+
+    # sign is included in width, so pad negative values by 1 more
+    if compact:
+      self.fmt = '%d'
+      self.fmt_neg = '%d'
+    else:
+      self.fmt = '%%0%dd' % (digits)
+      self.fmt_neg = '%%0%dd' % (digits + 1)
+
+    self.fmt_pair = dict()
+    for prefix in [('X', 'Y'), ('I', 'J')]:
+      self.fmt_pair[prefix] = '%s%s%s%s' % (
+        prefix[0], self.fmt, prefix[1], self.fmt)
+
+  # Returns codec for given CoordinateFormat, creating it if necessary.
+  @classmethod
+  def get(cls, cf, compact=False):
+
+    key = (cf.int_len, cf.dec_len, compact)
+    if not key in cls.codecs:
+      cls.codecs[key] = cls(cf, compact)
+    return cls.codecs[key]
+
+  # Converts iterable of floats to array of canonical ints.
+  def quantize(self, values):
+    scale = self.scale
+    return array.array('q', [int(round(v * scale)) for v in values])
+
+  # Render canonical int value. Agnostic of what it represents (X/Y/...)
+  def render(self, val):
+    if val < 0:
+      return self.fmt_neg % (val)
+    return self.fmt % (val)
+
+  # Render canonical tuple of ints with given prefix per axis. If compact,
+  # axes equal to those of prev, e.g. the current point, are omitted.
+  def render_vector(self, val, prefix=('X', 'Y'), prev=None):
+
+    if self.compact and not prev is None:
+      ret = ''
+      if val[0] != prev[0]: ret += prefix[0] + self.render(val[0])
+      if val[1] != prev[1]: ret += prefix[1] + self.render(val[1])
+      return ret
+
+    if val[0] >= 0 and val[1] >= 0 and prefix in self.fmt_pair:
+      return self.fmt_pair[prefix] % (val[0], val[1])
+
+    return '%s%s%s%s' % (
+      prefix[0], self.render(val[0]), prefix[1], self.render(val[1]))
+
+  # Render interleaved x/y canonical ints as list of text fragments. If
+  # compact, each point omits axes equal to those of the point before, or of
+  # prev for the first point.
+  def render_vectors(self, points, prefix=('X', 'Y'), prev=None):
+
+    render_vector = self.render_vector
+
+    if self.compact:
+      ret = list()
+      for val in zip(points[0::2], points[1::2]):
+        ret.append(render_vector(val, prefix, prev))
+        prev = val
+      return ret
+
+    fmt = self.fmt_pair.get(prefix)
+    if fmt is None:
+      return [render_vector(val, prefix)
+        for val in zip(points[0::2], points[1::2])]
+
+    return [fmt % val if val[0] >= 0 and val[1] >= 0
+      else render_vector(val, prefix)
+      for val in zip(points[0::2], points[1::2])]
 
 # ------------------------------------------------------------------------------
 # Basic numeric type formatted with CoordinateFormat.
@@ -18,13 +128,19 @@ class Scalar (Renderable):
         # val given explicitly
         self.val = int(val)
       else:
-        if type(init) is int or type(init) is float:
-          init = float(init)
-        else:
-          raise Exception('Invalid init type for Scalar: %s' % (type(init)))
+        self.val = Scalar.quantize(init)
 
-        # scale by decimal precision to get int value
-        self.val = int(round(init * (10 ** env.cf.dec_len)))
+  # Converts given Scalar, int or float to canonical int value.
+  @classmethod
+  def quantize(cls, init):
+
+    if issubclass(type(init), Scalar):
+      return init.val
+    elif type(init) is int or type(init) is float:
+      # scale by decimal precision to get int value
+      return int(round(init * env.codec.scale))
+    else:
+      raise Exception('Invalid init type for Scalar: %s' % (type(init)))
 
   # Mathematical operations.
   def __abs__(self):
@@ -44,6 +160,8 @@ class Scalar (Renderable):
   def __truediv__(self, other):
     other = float(other)
     return Scalar(val=self.val / other)
+  def __float__(self):
+    return self.val / env.codec.scale
 
   def __str__(self):
     return self.render() + ' at 0x%08X' % (id(self))
@@ -58,11 +176,12 @@ class Scalar (Renderable):
 
     if not type(self.val) is int: raise Exception()
 
-    sign_str = ''
-    if self.sign < 0: sign_str = '-'
+    return Scalar.format(self.val)
 
-    return '%s%s' % (sign_str, 
-      str(abs(self.val)).rjust(env.cf.int_len + env.cf.dec_len, '0'))
+  # Render canonical int value in specified coordinate format.
+  @classmethod
+  def format(cls, val):
+    return env.codec.render(val)
 
 # ------------------------------------------------------------------------------
 # Basic 2d type formatted with CoordinateFormat.
@@ -115,11 +234,572 @@ class Vector (Renderable):
   def __getitem__(self, key):
     return self.val[key]
 
+  # Canonical value as tuple of signed ints.
+  @property
+  def fixed(self): return (self.val[0].val, self.val[1].val)
+
+  # Creates Vector from canonical tuple of ints.
+  @classmethod
+  def from_fixed(cls, val):
+    return cls((Scalar(val=val[0]), Scalar(val=val[1])))
+
+  # Converts given Vector or tuple to canonical tuple of ints without
+  # allocating intermediate Scalar objects.
+  @classmethod
+  def quantize(cls, val):
+    if type(val) is Vector:
+      return val.fixed
+    elif type(val) is tuple:
+      return (Scalar.quantize(val[0]), Scalar.quantize(val[1]))
+    else:
+      raise Exception('Invalid init type for Vector: %s' % (type(val)))
+
   # Render vector with given prefix per axis to denote meaning (X/Y, I/J).
   def render(self, prefix=('X', 'Y')):
+    return Vector.format(self.fixed, prefix)
+
+  # Render canonical tuple of ints with given prefix per axis.
+  @classmethod
+  def format(cls, val, prefix=('X', 'Y')):
+    return env.codec.render_vector(val, prefix)
+
+
+# ------------------------------------------------------------------------------
+# Point arrays: interleaved x/y canonical ints, 2 entries per point. Either an
+# array.array('q') or a memoryview of int64 data given by the caller.
+# ------------------------------------------------------------------------------
+
+# Converts list of Vectors or tuples to point array.
+def points_from_vectors(vectors):
+
+  points = array.array('q')
+  for vector in vectors:
+    points.extend(Vector.quantize(vector))
+
+  return points
+
+# Converts object supporting the buffer protocol, e.g. array.array or an
+# N x 2 ndarray, to point array. Contiguous int64 data is assumed to be
+# canonical and used without copying; float data is quantized.
+def points_from_buffer(buf):
+
+  view = memoryview(buf)
+
+  if view.format in ('q', 'l', '<q', '<l') and view.itemsize == 8:
+    if view.ndim != 1: view = view.cast('B').cast('q')
+    points = view
+  elif view.format in ('d', 'f', '<d', '<f'):
+    if view.ndim != 1: view = view.cast('B').cast(view.format[-1])
+    points = env.codec.quantize(view.tolist())
+  else:
+    raise Exception('Unsupported buffer format: %s' % (view.format))
+
+  if len(points) % 2 != 0:
+    raise Exception('Buffer must contain x/y pairs: %d values' % (
+      len(points)))
+
+  return points
+
+# Returns given point array as array.array, copying views of caller-provided
+# buffers, e.g. so they can be pickled.
+def points_array(points):
+  if type(points) is memoryview:
+    return array.array('q', points.tobytes())
+  return points
+
+# Returns new point array offset by given canonical tuple of ints.
+def translate_points(points, offset):
+
+  dx, dy = offset
+
+  ret = array.array('q', bytes(8 * len(points)))
+  ret[0::2] = array.array('q', [x + dx for x in points[0::2]])
+  ret[1::2] = array.array('q', [y + dy for y in points[1::2]])
+
+  return ret
+
+# ------------------------------------------------------------------------------
+# Similarity transform of canonical ints, in the order aperture
+# transformations are applied by LM/LR/LS: mirror, rotation, scale, and
+# finally offset.
+# Point arrays are transformed in one pass per axis. Mirroring and rotation
+# by multiples of 90 degrees, with integer scale, use exact int arithmetic.
+# ------------------------------------------------------------------------------
+class Transform:
+
+  # Whether x coordinates are negated.
+  mirror = bool
+
+  # Counterclockwise rotation in degrees, in [0, 360).
+  rotation = float
+
+  scale = float
+
+  # Offset as canonical tuple of ints.
+  offset = tuple
+
+  # (a, b, c, d) mapping (x, y) to (a * x + b * y, c * x + d * y), as ints
+  # if exact.
+  matrix = tuple
+
+  # Decimal places of rotation and scale, limiting error of composition.
+  precision = 9
+
+  # mirror/rotation/scale: as loaded by LM/LR/LS
+  # offset: Vector or tuple added after other transformations
+  def __init__(self, mirror=False, rotation=0., scale=1., offset=(0, 0)):
+
+    self.mirror = bool(mirror)
+    self.rotation = round(float(rotation) % 360., self.precision) % 360.
+    self.scale = round(float(scale), self.precision)
+    self.offset = Vector.quantize(offset)
+
+    if self.scale <= 0:
+      raise Exception('Scale must be positive: %s' % (str(scale)))
+
+    # exact values for multiples of 90 degrees
+    if self.rotation % 90 == 0:
+      cos, sin = [(1, 0), (0, 1), (-1, 0), (0, -1)][int(self.rotation // 90)]
+    else:
+      cos = math.cos(math.radians(self.rotation))
+      sin = math.sin(math.radians(self.rotation))
+
+    sign = -1 if self.mirror else 1
+    matrix = (self.scale * cos * sign, -self.scale * sin,
+      self.scale * sin * sign, self.scale * cos)
+
+    if all([float(val).is_integer() for val in matrix]):
+      matrix = tuple([int(val) for val in matrix])
+
+    self.matrix = matrix
+
+  # Returns transform of given matrix and offset, which must be a
+  # similarity.
+  @classmethod
+  def from_matrix(cls, matrix, offset):
+
+    a, b, c, d = matrix
+    det = a * d - b * c
+    mirror = det < 0
+    scale = math.sqrt(abs(det))
+
+    # remove mirroring to leave rotation
+    if mirror: a, c = -a, -c
+
+    rotation = math.degrees(math.atan2(c / scale, a / scale))
+    return cls(mirror, rotation, scale, Vector.from_fixed(offset))
+
+  def __str__(self):
+    return 'Transform (mirror=%s, rotation=%s, scale=%s, offset=%s)' % (
+      self.mirror, self.rotation, self.scale, str(self.offset))
+
+  # Returns transform applying other, then this transform.
+  def __mul__(self, other):
+
+    a, b, c, d = self.matrix
+    e, f, g, h = other.matrix
+
+    return Transform.from_matrix(
+      (a * e + b * g, a * f + b * h, c * e + d * g, c * f + d * h),
+      self.apply(other.offset))
+
+  # Transform without offset, e.g. as applied to apertures.
+  @property
+  def linear(self):
+    return Transform(self.mirror, self.rotation, self.scale)
+
+  @property
+  def identity(self):
+    return not self.mirror and self.rotation == 0 and self.scale == 1 and \
+      self.offset == (0, 0)
+
+  # Returns transform applying this transform about given center, rather
+  # than the origin.
+  def centered(self, center):
+
+    center = Vector.quantize(center)
+    x, y = self.linear.apply(center)
+
+    return Transform(self.mirror, self.rotation, self.scale, Vector.from_fixed(
+      (center[0] - x + self.offset[0], center[1] - y + self.offset[1])))
+
+  # Returns given canonical tuple of ints transformed.
+  def apply(self, val):
+
+    a, b, c, d = self.matrix
+    x, y = val
+
+    x, y = (a * x + b * y, c * x + d * y)
+    if not type(self.matrix[0]) is int:
+      x, y = (int(round(x)), int(round(y)))
+
+    return (x + self.offset[0], y + self.offset[1])
+
+  # Returns new point array transformed.
+  def apply_points(self, points):
+
+    a, b, c, d = self.matrix
+    dx, dy = self.offset
+    xs = points[0::2]
+    ys = points[1::2]
+
+    ret = array.array('q', bytes(8 * len(points)))
+
+    # each axis maps to a single axis for multiples of 90 degrees
+    if type(a) is int and b == 0 and c == 0:
+      ret[0::2] = array.array('q', [a * x + dx for x in xs])
+      ret[1::2] = array.array('q', [d * y + dy for y in ys])
+    elif type(a) is int and a == 0 and d == 0:
+      ret[0::2] = array.array('q', [b * y + dx for y in ys])
+      ret[1::2] = array.array('q', [c * x + dy for x in xs])
+    elif type(a) is int:
+      ret[0::2] = array.array('q',
+        [a * x + b * y + dx for x, y in zip(xs, ys)])
+      ret[1::2] = array.array('q',
+        [c * x + d * y + dy for x, y in zip(xs, ys)])
+    else:
+      ret[0::2] = array.array('q',
+        [int(round(a * x + b * y)) + dx for x, y in zip(xs, ys)])
+      ret[1::2] = array.array('q',
+        [int(round(c * x + d * y)) + dy for x, y in zip(xs, ys)])
+
+    return ret
+
+# Default number of segments approximating a full circle, for arcs flattened
+# for geometric queries.
+ARC_SEGMENTS = 64
+
+# Returns points approximating arc from start to end with given arc
+# metadata, as stored in Contour.arcs, by segments segments per full
+# circle. Start is not included; end is included exactly.
+def arc_points(start, end, arc, segments=ARC_SEGMENTS):
+
+  interp_mode, quad_mode, center = arc
+  cx, cy = center
+
+  a0 = math.atan2(start[1] - cy, start[0] - cx)
+  a1 = math.atan2(end[1] - cy, end[0] - cx)
+  r0 = math.hypot(start[0] - cx, start[1] - cy)
+  r1 = math.hypot(end[0] - cx, end[1] - cy)
+
+  if interp_mode == gbrtypes.CounterClockwise:
+    sweep = (a1 - a0) % (2 * math.pi)
+  else:
+    sweep = -((a0 - a1) % (2 * math.pi))
+
+  # coincident start and end form a full circle unless single quadrant
+  if start == end and not quad_mode == gbrtypes.SingleQuadrant:
+    sweep = 2 * math.pi if sweep >= 0 else -2 * math.pi
+
+  count = max(1, int(math.ceil(abs(sweep) / (2 * math.pi) * segments)))
+
+  ret = list()
+  for idx in range(1, count):
+    angle = a0 + sweep * idx / count
+    radius = r0 + (r1 - r0) * idx / count
+    ret.append((cx + int(round(radius * math.cos(angle))),
+      cy + int(round(radius * math.sin(angle)))))
+  ret.append(end)
+
+  return ret
+
+# ------------------------------------------------------------------------------
+# Chain of segments stored as contiguous fixed-point coordinates.
+# Avoids a Vector/Scalar object per vertex for large regions.
+# ------------------------------------------------------------------------------
+class Contour:
+
+  # Operation used to reach a vertex.
+  MOVE = 0
+  DRAW = 1
+
+  # Interleaved x/y canonical ints, 2 entries per vertex. Either an
+  # array.array('q') or a memoryview of int64 data given by the caller.
+  points = array.array
+
+  # Operation per vertex, or None for a simple polyline (MOVE followed by DRAW).
+  ops = array.array
+
+  # Arc metadata keyed by vertex index of the edge's end vertex:
+  # (interp_mode, quad_mode, center as canonical tuple of ints).
+  arcs = dict
+
+  # Whether a closing edge from last vertex to first vertex is implied.
+  closed = bool
+
+  def __init__(self, points=None, ops=None, arcs=None, closed=False):
+
+    if points is None: points = array.array('q')
+    if arcs is None: arcs = dict()
+
+    self.points = points
+    self.ops = ops
+    self.arcs = arcs
+    self.closed = closed
+
+  def __len__(self):
+    return len(self.points) // 2
+
+  # Views of caller-provided buffers cannot be pickled, so copy them when
+  # sending to another process.
+  def __getstate__(self):
+
+    state = dict(self.__dict__)
+    state['points'] = points_array(self.points)
+    return state
+
+  # Builds closed polygon from list of Vectors or tuples.
+  @classmethod
+  def from_vectors(cls, vectors, closed=True):
+    return cls(points_from_vectors(vectors), closed=closed)
+
+  # Builds closed polygon from object supporting the buffer protocol, as
+  # converted by points_from_buffer().
+  @classmethod
+  def from_buffer(cls, buf, closed=True):
+    return cls(points_from_buffer(buf), closed=closed)
+
+  # Builds chain from list of Segment objects, inserting moves between
+  # segments which are not connected.
+  @classmethod
+  def from_segments(cls, segments):
+
+    contour = cls(ops=array.array('B'))
+    for segment in segments:
+      contour.append_segment(segment.vectors, segment.interp_mode,
+        segment.quad_mode, segment.center)
+
+    return contour
+
+  # Appends segment from start to end, given as Vectors or tuples.
+  def append_segment(self, vectors, interp_mode=None, quad_mode=None,
+    center=None):
+
+    arc = None
+    if issubclass(type(interp_mode), gbrtypes.Circular):
+      arc = (interp_mode, quad_mode, Vector.quantize(center))
+
+    self.append_edge(
+      Vector.quantize(vectors[0]), Vector.quantize(vectors[1]), arc)
+
+  # Appends edge from start to end, given as canonical tuples of ints, with
+  # arc metadata as stored in arcs, or None if linear.
+  def append_edge(self, start, end, arc=None):
+
+    count = len(self)
+
+    # views of caller-provided buffers are read-only
+    if type(self.points) is memoryview:
+      self.points = array.array('q', self.points.tobytes())
+
+    # expand implicit operations of simple polyline
+    if self.ops is None:
+      self.ops = array.array('B', [Contour.DRAW]) * count
+      if count > 0: self.ops[0] = Contour.MOVE
+
+    # insert move if not connected to previous segment
+    if count == 0 or not (self.points[-2], self.points[-1]) == start:
+      self.points.extend(start)
+      self.ops.append(Contour.MOVE)
+      count += 1
+
+    self.points.extend(end)
+    self.ops.append(Contour.DRAW)
+
+    if not arc is None:
+      self.arcs[count] = arc
+
+  # Returns new contour offset by given canonical tuple of ints.
+  def translate(self, offset):
+
+    dx, dy = offset
+
+    points = translate_points(self.points, offset)
+
+    ops = None if self.ops is None else array.array('B', self.ops)
+
+    arcs = dict()
+    for idx, (interp_mode, quad_mode, center) in self.arcs.items():
+      arcs[idx] = (interp_mode, quad_mode, (center[0] + dx, center[1] + dy))
+
+    return Contour(points, ops, arcs, self.closed)
+
+  # Returns new contour transformed by given Transform. Mirroring reverses
+  # the direction of arcs.
+  def transform(self, transform):
+
+    points = transform.apply_points(self.points)
+
+    ops = None if self.ops is None else array.array('B', self.ops)
+
+    arcs = dict()
+    for idx, (interp_mode, quad_mode, center) in self.arcs.items():
+      if transform.mirror:
+        if interp_mode == gbrtypes.Clockwise:
+          interp_mode = gbrtypes.CounterClockwise()
+        else:
+          interp_mode = gbrtypes.Clockwise()
+      arcs[idx] = (interp_mode, quad_mode, transform.apply(center))
+
+    return Contour(points, ops, arcs, self.closed)
+
+  # Updates given hashlib object with vertices, operations and arcs.
+  def update_digest(self, h):
+
+    ops = b'' if self.ops is None else self.ops
+    h.update(b'%d %d %d\n' % (len(self.points), len(ops), self.closed))
+    h.update(self.points)
+    h.update(ops)
+
+    for idx in sorted(self.arcs):
+      interp_mode, quad_mode, center = self.arcs[idx]
+      h.update(('%d %s %s %d %d\n' % (idx, interp_mode, quad_mode,
+        center[0], center[1])).encode('utf-8'))
+
+  # Returns (contour, count) with redundant vertices of straight edges
+  # removed: repeated vertices, and vertices joining collinear edges of the
+  # same direction. Arcs are kept as they are. count is the number of
+  # vertices removed. A closed contour that would be left with fewer than 3
+  # vertices, e.g. of a single repeated vertex, is degenerate and returned
+  # unchanged.
+  def simplify(self):
+
+    points = array.array('q')
+    ops = array.array('B')
+    arcs = dict()
+
+    src = self.points
+    for idx in range(len(self)):
+      x, y = src[2 * idx], src[2 * idx + 1]
+      op = self.op(idx)
+      arc = self.arcs.get(idx)
+
+      if op == Contour.DRAW and arc is None and len(ops) > 0:
+
+        # zero-length edge
+        if points[-2] == x and points[-1] == y:
+          continue
+
+        # previous vertex joins straight edges of the same direction
+        if ops[-1] == Contour.DRAW and not len(ops) - 1 in arcs:
+          ax, ay = points[-2] - points[-4], points[-1] - points[-3]
+          bx, by = x - points[-2], y - points[-1]
+          if ax * by == ay * bx and ax * bx + ay * by > 0:
+            points[-2] = x
+            points[-1] = y
+            continue
+
+      if not arc is None:
+        arcs[len(ops)] = arc
+      points.extend((x, y))
+      ops.append(op)
+
+    # closing edge from last vertex to first vertex is straight
+    if self.closed:
+      while len(ops) > 2 and ops[-1] == Contour.DRAW and \
+        not len(ops) - 1 in arcs:
+
+        ax, ay = points[-2] - points[-4], points[-1] - points[-3]
+        bx, by = points[0] - points[-2], points[1] - points[-1]
+        if not ((bx == 0 and by == 0) or
+          (ax * by == ay * bx and ax * bx + ay * by > 0)):
+          break
+
+        del points[-2:]
+        ops.pop()
+
+    # keep implicit operations of simple polyline
+    if ops.count(Contour.MOVE) == 1 and ops[0] == Contour.MOVE:
+      ops = None
+
+    contour = Contour(points, ops, arcs, self.closed)
+    if self.closed and len(contour) < 3:
+      return (self, 0)
+
+    return (contour, len(self) - len(contour))
+
+  # Returns operation for vertex at given index.
+  def op(self, idx):
+    if self.ops is None:
+      return Contour.MOVE if idx == 0 else Contour.DRAW
+    return self.ops[idx]
+
+  # Returns vertex at given index as canonical tuple of ints.
+  def vertex(self, idx):
+    return (self.points[2 * idx], self.points[2 * idx + 1])
+
+  # Yields each edge as (start, end, arc), with arc None for linear edges.
+  def edges(self):
+
+    start = None
+    for idx in range(len(self)):
+      val = self.vertex(idx)
+      if self.op(idx) == Contour.DRAW:
+        yield (start, val, self.arcs.get(idx))
+      start = val
+
+    if self.closed and len(self) > 1:
+      yield (start, self.vertex(0), None)
+
+  # Returns (x_min, y_min, x_max, y_max) of contour as canonical ints,
+  # including full circles of arcs, or None if empty.
+  def bounds(self):
+
+    if len(self) == 0:
+      return None
+
+    xs = self.points[0::2]
+    ys = self.points[1::2]
+    ret = [min(xs), min(ys), max(xs), max(ys)]
+
+    for idx, (interp_mode, quad_mode, center) in self.arcs.items():
+      x, y = self.vertex(idx)
+      radius = int(math.ceil(math.hypot(x - center[0], y - center[1])))
+      ret[0] = min(ret[0], center[0] - radius)
+      ret[1] = min(ret[1], center[1] - radius)
+      ret[2] = max(ret[2], center[0] + radius)
+      ret[3] = max(ret[3], center[1] + radius)
+
+    return tuple(ret)
+
+  # Returns new contour with arcs approximated by straight edges, see
+  # arc_points(), or this contour if it has no arcs.
+  def flatten(self, segments=ARC_SEGMENTS):
+
+    if len(self.arcs) == 0:
+      return self
+
+    points = array.array('q')
+    ops = array.array('B')
+
+    for idx in range(len(self)):
+      val = self.vertex(idx)
+      op = self.op(idx)
+      arc = self.arcs.get(idx)
+
+      if op == Contour.DRAW and not arc is None:
+        for point in arc_points(start, val, arc, segments)[:-1]:
+          points.extend(point)
+          ops.append(Contour.DRAW)
+
+      points.extend(val)
+      ops.append(op)
+      start = val
+
+    return Contour(points, ops, None, self.closed)
+
+  # Returns point array of each chain of edges, starting at a move, with
+  # arcs flattened.
+  def loops(self, segments=ARC_SEGMENTS):
+
+    contour = self.flatten(segments)
+    points = contour.points
+
+    if contour.ops is None:
+      return [points] if len(points) > 0 else []
 
-    out = '%s%s%s%s' % (
-      prefix[0], self.val[0].render(), 
-      prefix[1], self.val[1].render())
+    starts = [idx for idx, op in enumerate(contour.ops)
+      if op == Contour.MOVE] + [len(contour)]
 
-    return out
+    return [points[2 * start:2 * end]
+      for start, end in zip(starts[:-1], starts[1:])]
@@ -0,0 +1,219 @@
+import array
+import copy
+import itertools
+import math
+
+from common import *
+from environment import Environment as env
+import gbrtypes
+import numeric
+import aperture
+import graphic
+
+# ------------------------------------------------------------------------------
+# Reordering of graphics to shorten the path travelled between them.
+#
+# Flashes and tracks of the same polarity may be emitted in any order without
+# changing the image, so each run of consecutive flashes and tracks of one
+# polarity is sorted along a Hilbert curve. Other graphics, e.g. regions and
+# blocks, are kept in place and end a run, as do flashes of block apertures
+# containing objects of clear polarity, which clear what was drawn before. Sorting is O(n log n) in the
+# number of objects.
+# Runs may also be grouped by aperture to minimize aperture selections.
+# ------------------------------------------------------------------------------
+
+# Number of bits per axis of Hilbert curve coordinates.
+HILBERT_ORDER = 16
+
+# Builds table mapping (state, 4 bits of x, 4 bits of y) to 8 bits of
+# Hilbert index and next state, so 4 levels of the curve are resolved per
+# lookup. State tracks the orientation of the current sub-square as flip and
+# swap of coordinates.
+def hilbert_table():
+
+  table = array.array('H', bytes(2 * 4 * 256))
+
+  for state, x, y in itertools.product(range(4), range(16), range(16)):
+    flip, swap = state & 1, state >> 1
+    d = 0
+
+    for shift in (3, 2, 1, 0):
+      rx, ry = (x >> shift) & 1, (y >> shift) & 1
+      if swap: rx, ry = ry, rx
+      if flip: rx, ry = rx ^ 1, ry ^ 1
+
+      d = (d << 2) | ((3 * rx) ^ ry)
+
+      if ry == 0:
+        flip ^= rx
+        swap ^= 1
+
+    table[(state << 8) | (x << 4) | y] = d | ((flip | (swap << 1)) << 8)
+
+  return table
+
+HILBERT_TABLE = hilbert_table()
+
+# Returns index along Hilbert curve of given non-negative ints, each less
+# than 2 ** HILBERT_ORDER.
+def hilbert(x, y):
+
+  table = HILBERT_TABLE
+  state = 0
+  d = 0
+
+  for shift in range(HILBERT_ORDER - 4, -1, -4):
+    entry = table[(state << 8) | (((x >> shift) & 15) << 4) |
+      ((y >> shift) & 15)]
+    d = (d << 8) | (entry & 255)
+    state = entry >> 8
+
+  return d
+
+# Returns Hilbert index of each of given points, given as canonical tuples of
+# ints, scaled to the bounding box of all points.
+def hilbert_keys(points):
+
+  if len(points) == 0:
+    return list()
+
+  x_min = min(point[0] for point in points)
+  y_min = min(point[1] for point in points)
+  span = max(max(point[0] for point in points) - x_min,
+    max(point[1] for point in points) - y_min, 1)
+  scale = (1 << HILBERT_ORDER) - 1
+
+  return [hilbert((point[0] - x_min) * scale // span,
+    (point[1] - y_min) * scale // span) for point in points]
+
+# Returns whether given graphic may be reordered within its polarity run.
+def reorderable(obj):
+
+  if type(obj) is graphic.FlashObject:
+    return not clears(obj.ap)
+  elif type(obj) is graphic.FlashArray:
+    return len(obj) > 0 and not clears(obj.ap)
+  elif type(obj) is graphic.Track:
+    return len(obj.contour) > 0 and not clears(obj.ap)
+
+  return False
+
+# Returns whether given aperture is a block aperture containing objects of
+# clear polarity, including objects nested in block apertures it flashes.
+def clears(ap):
+
+  if not type(ap) is aperture.BlockAperture:
+    return False
+
+  for obj in ap.block.objects:
+    if obj.polarity == gbrtypes.Clear:
+      return True
+    if hasattr(obj, 'ap') and clears(obj.ap):
+      return True
+
+  return False
+
+# Returns points visited by given reorderable graphic in order, as canonical
+# tuples of ints.
+def path(obj):
+
+  if type(obj) is graphic.FlashObject:
+    return [numeric.Vector.quantize(obj.vector)]
+  elif type(obj) is graphic.Track:
+    points = obj.contour.points
+  else:
+    points = obj.points
+
+  return list(zip(points[0::2], points[1::2]))
+
+# Returns first point visited by given reorderable graphic.
+def start(obj):
+
+  if type(obj) is graphic.FlashObject:
+    return numeric.Vector.quantize(obj.vector)
+  elif type(obj) is graphic.Track:
+    return obj.contour.vertex(0)
+
+  return (obj.points[0], obj.points[1])
+
+# Returns total distance in units between consecutive points visited by
+# given graphics. Graphics which are not reorderable are skipped.
+def travel(objs):
+
+  total = 0.
+  last = None
+
+  for obj in objs:
+    if not reorderable(obj): continue
+
+    for point in path(obj):
+      if not last is None:
+        total += math.hypot(point[0] - last[0], point[1] - last[1])
+      last = point
+
+  return total / env.codec.scale
+
+# Returns copy of given flash array with points sorted along Hilbert curve.
+def order_array(obj):
+
+  points = path(obj)
+  keys = hilbert_keys(points)
+  indices = sorted(range(len(points)), key=keys.__getitem__)
+
+  ret = array.array('q', bytes(8 * len(obj.points)))
+  ret[0::2] = array.array('q', [points[idx][0] for idx in indices])
+  ret[1::2] = array.array('q', [points[idx][1] for idx in indices])
+
+  obj = copy.copy(obj)
+  obj.points = ret
+  return obj
+
+# Returns given run of objects of the same polarity sorted along Hilbert
+# curve by their first point.
+def order_run(run):
+
+  run = [order_array(obj) if type(obj) is graphic.FlashArray else obj
+    for obj in run]
+  keys = hilbert_keys([start(obj) for obj in run])
+
+  return [obj for key, idx, obj in sorted(zip(keys, itertools.count(), run))]
+
+# Returns given run of objects of the same polarity grouped by aperture, in
+# order of D-code. Order within each group is kept.
+def group_run(run):
+  return sorted(run, key=lambda obj: obj.ap.index)
+
+# Returns list of given graphics with each run of consecutive flashes and
+# tracks of the same polarity reordered by given function taking and
+# returning a run.
+def reorder(objs, fn):
+
+  ret = list()
+  run = list()
+
+  for obj in objs:
+    movable = reorderable(obj)
+
+    if run and not (movable and obj.polarity == run[0].polarity):
+      ret += fn(run)
+      run = list()
+
+    if movable:
+      run.append(obj)
+    else:
+      ret.append(obj)
+
+  ret += fn(run)
+
+  return ret
+
+# Returns list of given graphics with each run of consecutive flashes and
+# tracks of the same polarity reordered to shorten travel.
+def order(objs):
+  return reorder(objs, order_run)
+
+# Returns list of given graphics with each run of consecutive flashes and
+# tracks of the same polarity grouped by aperture, so each aperture is
+# selected once per run.
+def group(objs):
+  return reorder(objs, group_run)
@@ -0,0 +1,548 @@
+import array
+import codecs
+import logging
+import re
+import time
+
+from common import *
+from environment import Environment as env
+import gbrtypes
+import numeric
+import command
+import aperture
+import graphic
+import layer
+
+# Number of bytes or characters read from file at a time.
+CHUNK_LEN = 1 << 16
+
+# Millimeters per unit.
+UNIT_MM = {'IN': 25.4, 'MM': 1.}
+
+# Function code word: optional G code, coordinates and D code.
+WORD_RE = re.compile(
+  r'(?:G0*(\d+))?(?:X([+-]?\d+))?(?:Y([+-]?\d+))?'
+  r'(?:I([+-]?\d+))?(?:J([+-]?\d+))?(?:D0*(\d+))?$')
+
+# Yields (extended, text) for each command in given file handle, reading it
+# in chunks. Extended commands are given without enclosing '%', function
+# code commands without terminating '*'. on_chunk, if given, is called with
+# each chunk as read.
+def tokenize(fh, chunk_len=CHUNK_LEN, on_chunk=None):
+
+  pending = ''
+
+  # bytes of a character may be split across chunks
+  decoder = codecs.getincrementaldecoder('utf-8')()
+
+  while True:
+    chunk = fh.read(chunk_len)
+    if not chunk:
+      break
+
+    if not on_chunk is None: on_chunk(chunk)
+
+    if type(chunk) is bytes: chunk = decoder.decode(chunk)
+
+    # line endings carry no meaning
+    pending += chunk.replace('\r', '').replace('\n', '')
+
+    pos = 0
+    while pos < len(pending):
+
+      if pending[pos] == '%':
+        end = pending.find('%', pos + 1)
+        if end < 0: break
+        yield (True, pending[pos + 1:end])
+      else:
+        end = pending.find('*', pos)
+        if end < 0: break
+        yield (False, pending[pos:end])
+
+      pos = end + 1
+
+    pending = pending[pos:]
+
+  if len(pending.strip()) > 0:
+    raise Exception('Unterminated command: %s' % (pending[:80]))
+
+# ------------------------------------------------------------------------------
+# Reads a Gerber X2 file into a Layer of Apertures, Regions, FlashObjects and
+# Tracks.
+# The file is tokenized in chunks, so it is never held in memory as a whole.
+# Coordinates are converted to the CoordinateFormat and unit of the current
+# environment.
+# ------------------------------------------------------------------------------
+class Reader:
+
+  # Registry passed to layers created, e.g. to merge files of a board.
+  registry = aperture.Registry
+
+  # Attribute classes by name, from containers in gbrtypes.
+  catalog = dict
+
+  # Bytes read and seconds taken by last read(). Files opened in text mode
+  # are counted as encoded, with line endings as translated.
+  size = int
+  elapsed = float
+
+  def __init__(self, registry=None):
+
+    self.registry = registry
+    self.size = 0
+    self.elapsed = 0.
+
+    # handlers keyed by opcodes of command classes
+    self.g_codes = dict([(cls.opcode, handler) for cls, handler in [
+      (command.SetInterpLinear, lambda: self.set_interp(gbrtypes.Linear())),
+      (command.SetInterpClockwise,
+        lambda: self.set_interp(gbrtypes.Clockwise())),
+      (command.SetInterpCounterClockwise,
+        lambda: self.set_interp(gbrtypes.CounterClockwise())),
+      (command.SetQuadSingle,
+        lambda: self.set_quad(gbrtypes.SingleQuadrant())),
+      (command.SetQuadMulti, lambda: self.set_quad(gbrtypes.Multi())),
+      (command.StartRegion, self.start_region),
+      (command.EndRegion, self.end_region),
+    ]])
+
+    # extended commands keyed by 2-character code
+    self.extended_codes = dict([(cls.opcode[:2], handler)
+      for cls, handler in [
+      (command.SetCoordinateFormat, self.format),
+      (command.SetUnit, self.mode),
+      (command.DefineAperture, self.define_aperture),
+      (command.DefineBlockStart, self.block_aperture),
+      (command.StepRepeat, self.step_repeat),
+      (command.LoadPolarity, self.load_polarity),
+      (command.LoadMirror, self.load_mirror),
+      (command.LoadRotation, self.load_rotation),
+      (command.LoadScale, self.load_scale),
+      (command.AddFileAttribute,
+        lambda data: self.attribute(command.AddFileAttribute, data)),
+      (command.AddApertureAttribute,
+        lambda data: self.attribute(command.AddApertureAttribute, data)),
+      (command.AddObjectAttribute,
+        lambda data: self.attribute(command.AddObjectAttribute, data)),
+      (command.DeleteAttribute, self.delete_attribute),
+    ]])
+
+    self.catalog = dict()
+    for container in (gbrtypes.FileAttributes, gbrtypes.ApertureAttributes,
+      gbrtypes.ObjectAttributes):
+      for cls in container.attrs:
+        self.catalog[cls.name] = cls
+
+  # Throughput of last read() in MB/s.
+  @property
+  def throughput(self):
+    if self.elapsed == 0.: return 0.
+    return self.size / self.elapsed / 1e6
+
+  # Read given file path or file-like object, returning new Layer.
+  def read(self, file):
+
+    if type(file) is str:
+      fh = open(file, 'rb')
+    else:
+      fh = file
+
+    start = time.perf_counter()
+
+    self.reset()
+
+    for extended, text in tokenize(fh, on_chunk=self.count):
+      if extended:
+        self.extended(text)
+      else:
+        self.function(text)
+
+    self.end_track()
+
+    self.elapsed = time.perf_counter() - start
+
+    if type(file) is str:
+      fh.close()
+
+    logging.info('Read "%s": %d bytes, %.1f MB/s' % (
+      str(file), self.size, self.throughput))
+
+    return self.layer
+
+  # Adds size of given chunk read.
+  def count(self, chunk):
+    if type(chunk) is str: chunk = chunk.encode('utf-8')
+    self.size += len(chunk)
+
+  # Initialize state for reading a new file.
+  def reset(self):
+
+    self.size = 0
+    self.layer = layer.Layer(gbrtypes.Positive(), None, self.registry)
+
+    # stack of blocks being read inside AB/SR, graphics go to innermost
+    self.blocks = list()
+
+    # format of file and scale to environment format
+    self.scale = None
+
+    # apertures by D-code in file
+    self.apertures = dict()
+
+    # attributes by name, applied to subsequent objects
+    self.ap_attrs = dict()
+    self.obj_attrs = dict()
+
+    # graphics state
+    self.point = (0, 0)
+    self.ap = None
+    self.polarity = gbrtypes.Dark()
+    self.interp_mode = None
+
+    # aperture transformation as loaded, and as numeric.Transform
+    self.ap_mirror = 'N'
+    self.ap_rotation = 0.
+    self.ap_scale = 1.
+    self.ap_transform = None
+    self.quad_mode = gbrtypes.Multi()
+
+    # contour being read in region mode
+    self.contour = None
+
+    # contour being stroked outside region mode
+    self.track = None
+
+  # Convert coordinate given as text in file format to canonical int.
+  def coord(self, text):
+    if self.scale is None:
+      raise Exception('Coordinate before format specification')
+    if self.scale == 1.:
+      return int(text)
+    return int(round(int(text) * self.scale))
+
+  # Convert length in file unit to unit of environment.
+  def length(self, val):
+    return val * self.unit_scale
+
+  # Add graphic object to layer or innermost block being read.
+  def add(self, obj, ap_attrs=False):
+
+    if len(self.obj_attrs) > 0:
+      obj.object_attributes = gbrtypes.ObjectAttributes()
+      obj.object_attributes.append(list(self.obj_attrs.values()))
+
+    if ap_attrs and len(self.ap_attrs) > 0:
+      obj.aperture_attributes = gbrtypes.ApertureAttributes()
+      obj.aperture_attributes.append(list(self.ap_attrs.values()))
+
+    if len(self.blocks) > 0:
+      self.blocks[-1][1].append(obj)
+    else:
+      self.layer.append(obj)
+
+  # Returns center of arc from current point to end in absolute coordinates.
+  def center(self, end, offset):
+
+    if self.quad_mode == gbrtypes.Multi:
+      return (self.point[0] + offset[0], self.point[1] + offset[1])
+
+    # single quadrant offsets are unsigned: pick sign equidistant to ends
+    best = None
+    for sx in (1, -1):
+      for sy in (1, -1):
+        center = (self.point[0] + sx * offset[0], self.point[1] + sy * offset[1])
+        diff = abs(
+          (center[0] - self.point[0]) ** 2 + (center[1] - self.point[1]) ** 2 -
+          (center[0] - end[0]) ** 2 - (center[1] - end[1]) ** 2)
+        if best is None or diff < best[0]:
+          best = (diff, center)
+
+    return best[1]
+
+  # Handle function code command.
+  def function(self, text):
+
+    if text.startswith('G04') or text.startswith('G4 '):
+      return
+
+    if text == 'M02' or text == 'M00' or text == 'M01':
+      self.end_track()
+      return
+
+    match = WORD_RE.match(text)
+    if match is None:
+      raise Exception('Invalid command: %s' % (text))
+
+    g_code, x, y, i, j, d_code = match.groups()
+
+    if not g_code is None:
+      self.g_code(int(g_code))
+
+    if not x is None or not y is None:
+      end = (
+        self.point[0] if x is None else self.coord(x),
+        self.point[1] if y is None else self.coord(y))
+    else:
+      end = self.point
+
+    if d_code is None:
+      return
+
+    d_code = int(d_code)
+
+    # consecutive D01/D02 outside region mode form one track
+    if d_code >= 3:
+      self.end_track()
+
+    if d_code == 1:
+      self.interpolate(end, (
+        0 if i is None else self.coord(i),
+        0 if j is None else self.coord(j)))
+    elif d_code == 2:
+      self.point = end
+    elif d_code == 3:
+      self.point = end
+      flash = graphic.FlashObject(
+        self.ap, numeric.Vector.from_fixed(end), self.polarity)
+      flash.ap_transform = self.ap.reduce_transform(self.ap_transform)
+      self.add(flash)
+    elif d_code >= 10:
+      if not d_code in self.apertures:
+        raise Exception('Undefined aperture: D%d' % (d_code))
+      self.ap = self.apertures[d_code]
+    else:
+      raise Exception('Invalid D code: %s' % (text))
+
+  def g_code(self, code):
+
+    code = 'G%02d' % (code)
+
+    if code in self.g_codes:
+      self.g_codes[code]()
+    elif code in ('G54', 'G55', 'G70', 'G71', 'G90', 'G91'):
+      # deprecated codes with no effect on supported files
+      logging.warning('Ignoring deprecated code: %s' % (code))
+    else:
+      raise Exception('Unsupported G code: %s' % (code))
+
+  def set_interp(self, interp_mode):
+    self.interp_mode = interp_mode
+
+  def set_quad(self, quad_mode):
+    self.quad_mode = quad_mode
+
+  def start_region(self):
+    self.end_track()
+    self.contour = numeric.Contour(ops=array.array('B'))
+
+  def end_region(self):
+    self.add(graphic.Region(self.contour, self.polarity), True)
+    self.contour = None
+
+  # Add track being read, if any.
+  def end_track(self):
+
+    if not self.track is None:
+      track = graphic.Track(self.ap, self.track, self.polarity)
+      track.ap_transform = self.ap.reduce_transform(self.ap_transform)
+      self.add(track)
+      self.track = None
+
+  # Handle D01 from current point to given end, either as an edge of the
+  # current region or as a stroke of the current aperture.
+  def interpolate(self, end, offset):
+
+    contour = self.contour
+    if contour is None:
+      if self.ap is None:
+        raise Exception('D01 outside region without aperture')
+      if self.track is None:
+        self.track = numeric.Contour(ops=array.array('B'))
+      contour = self.track
+
+    arc = None
+    if issubclass(type(self.interp_mode), gbrtypes.Circular):
+      arc = (self.interp_mode, self.quad_mode, self.center(end, offset))
+
+    contour.append_edge(self.point, end, arc)
+    self.point = end
+
+  # Handle extended code command, possibly with multiple data blocks.
+  def extended(self, text):
+
+    # attributes, polarity and blocks apply to subsequent objects only
+    self.end_track()
+
+    for block in text.split('*'):
+      if len(block) == 0:
+        continue
+
+      opcode = block[:2]
+      data = block[2:]
+
+      if opcode in self.extended_codes:
+        self.extended_codes[opcode](data)
+      elif opcode in ('IP', 'OF', 'SF', 'IN', 'LN', 'AS', 'MI', 'IR'):
+        logging.warning('Ignoring deprecated command: %s' % (opcode))
+      else:
+        raise Exception('Unsupported command: %s' % (opcode))
+
+  def load_polarity(self, data):
+    self.polarity = gbrtypes.Dark() if data == 'D' else gbrtypes.Clear()
+
+  def load_mirror(self, data):
+
+    if not data in ('N', 'X', 'Y', 'XY'):
+      raise Exception('Invalid mirroring: %s' % (data))
+
+    self.ap_mirror = data
+    self.update_transform()
+
+  def load_rotation(self, data):
+    self.ap_rotation = float(data)
+    self.update_transform()
+
+  def load_scale(self, data):
+    self.ap_scale = float(data)
+    self.update_transform()
+
+  # Compose aperture transformation, applied as mirroring, then rotation,
+  # then scale.
+  def update_transform(self):
+
+    # mirroring y is mirroring x and rotating by 180 degrees
+    transform = numeric.Transform(
+      mirror=self.ap_mirror in ('X', 'Y'),
+      rotation=self.ap_rotation + (180. if 'Y' in self.ap_mirror else 0.),
+      scale=self.ap_scale)
+
+    self.ap_transform = None if transform.identity else transform
+
+  def format(self, data):
+
+    match = re.match(r'([LT])([AI])X(\d)(\d)Y(\d)(\d)$', data)
+    if match is None or match.group(1) != 'L' or match.group(2) != 'A':
+      raise Exception('Unsupported format specification: %s' % (data))
+
+    self.dec_len = int(match.group(4))
+    self.update_scale()
+
+  def mode(self, data):
+
+    if not data in UNIT_MM:
+      raise Exception('Unsupported unit: %s' % (data))
+
+    self.unit = data
+    self.update_scale()
+
+  # Compute scale from file coordinates to canonical ints of environment.
+  def update_scale(self):
+
+    if not hasattr(self, 'dec_len'): return
+
+    unit = getattr(self, 'unit', 'IN')
+    env_unit = env.unit().render() if type(env.unit) is type else \
+      env.unit.render()
+
+    self.unit_scale = UNIT_MM[unit] / UNIT_MM[env_unit]
+    self.scale = self.unit_scale * (10 ** env.cf.dec_len) / \
+      (10 ** self.dec_len)
+
+  def define_aperture(self, data):
+
+    match = re.match(r'D0*(\d+)([A-Za-z_][^,]*)(?:,(.*))?$', data)
+    if match is None:
+      raise Exception('Invalid aperture definition: %s' % (data))
+
+    d_code = int(match.group(1))
+    template = match.group(2)
+    params = list()
+    if not match.group(3) is None:
+      params = [float(p) for p in match.group(3).split('X')]
+
+    # parameters other than polygon vertices/rotation are lengths
+    def lengths(vals): return [self.length(v) for v in vals]
+
+    if template == 'C':
+      ap = aperture.Circle(*lengths(params[:1] + params[1:2]))
+    elif template == 'R':
+      ap = aperture.Rectangle(*lengths(params[:3]))
+    elif template == 'O':
+      ap = aperture.Obround(*lengths(params[:3]))
+    elif template == 'P':
+      hole = None
+      if len(params) > 3: hole = self.length(params[3])
+      ap = aperture.Polygon(self.length(params[0]), int(params[1]),
+        params[2] if len(params) > 2 else 0., hole)
+    else:
+      raise Exception('Unsupported aperture template: %s' % (template))
+
+    ap.append(list(self.ap_attrs.values()))
+
+    self.apertures[d_code] = self.layer.append_aperture(ap)
+
+  # Open or close block aperture.
+  def block_aperture(self, data):
+
+    if len(data) > 0:
+      match = re.match(r'D0*(\d+)$', data)
+      if match is None:
+        raise Exception('Invalid block aperture: %s' % (data))
+      self.blocks.append((int(match.group(1)), graphic.Block()))
+    else:
+      d_code, block = self.blocks.pop()
+      self.apertures[d_code] = self.layer.append_aperture(
+        aperture.BlockAperture(block))
+
+  # Open or close step and repeat block. Opening a block closes any
+  # block currently open.
+  def step_repeat(self, data):
+
+    if len(self.blocks) > 0 and type(self.blocks[-1][0]) is tuple:
+      (count, step), block = self.blocks.pop()
+      self.add(graphic.StepRepeat.grid(block, (0., 0.), count, step))
+
+    if len(data) > 0:
+      match = re.match(r'X(\d+)Y(\d+)I([0-9.]+)J([0-9.]+)$', data)
+      if match is None:
+        raise Exception('Invalid step and repeat: %s' % (data))
+
+      count = (int(match.group(1)), int(match.group(2)))
+      step = (self.length(float(match.group(3))),
+        self.length(float(match.group(4))))
+
+      if count != (1, 1):
+        self.blocks.append(((count, step), graphic.Block()))
+
+  # Create attribute object from catalog, given name and values as text.
+  def attribute(self, cmd, data):
+
+    fields = data.split(',')
+    name = fields[0]
+
+    # checksum is recomputed when written
+    if name == '.MD5': return
+
+    cls = self.catalog.get(name)
+    if cls is None:
+      logging.warning('Ignoring unknown attribute: %s' % (name))
+      return
+
+    attr = cls.__new__(cls)
+    gbrtypes.Attribute.__init__(attr, fields[1:])
+
+    if cmd is command.AddFileAttribute:
+      self.layer.append(attr)
+    elif cmd is command.AddApertureAttribute:
+      self.ap_attrs[name] = attr
+    else:
+      self.obj_attrs[name] = attr
+
+  def delete_attribute(self, data):
+
+    if len(data) == 0:
+      self.ap_attrs = dict()
+      self.obj_attrs = dict()
+    else:
+      self.ap_attrs.pop(data, None)
+      self.obj_attrs.pop(data, None)
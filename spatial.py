@@ -0,0 +1,582 @@
+import heapq
+import math
+
+from common import *
+from environment import Environment as env
+import gbrtypes
+import numeric
+import aperture
+import graphic
+
+# ------------------------------------------------------------------------------
+# Geometric queries over graphics: shapes, distances and a spatial index.
+#
+# Each graphic is reduced to Shapes, either a filled polygon or the area
+# within a radius of a chain of edges or a single point, e.g. a circle flash
+# or a round track. Arcs are flattened, and holes of apertures are ignored.
+# Distances are computed over all edges of a shape at once, with edges far
+# from the other shape skipped.
+# ------------------------------------------------------------------------------
+
+# Area covered by part of a graphic.
+class Shape:
+
+  # Vertices as flat list of canonical ints: x0, y0, x1, y1, ...
+  points = list
+
+  # Whether shape is the polygon enclosed by points, closed from last to
+  # first vertex, rather than the chain of edges through points.
+  filled = bool
+
+  # Distance from polygon or chain covered, in canonical units.
+  radius = float
+
+  # Whether shape adds to the image, rather than clearing it.
+  dark = bool
+
+  # (x_min, y_min, x_max, y_max) as canonical ints.
+  bounds = tuple
+
+  def __init__(self, points, filled, radius=0., dark=True):
+
+    self.points = points
+    self.filled = filled
+    self.radius = radius
+    self.dark = dark
+
+    xs = points[0::2]
+    ys = points[1::2]
+    margin = int(math.ceil(radius))
+    self.bounds = (min(xs) - margin, min(ys) - margin, max(xs) + margin,
+      max(ys) + margin)
+
+  # Returns edges as list of (x0, y0, x1, y1), a single point being an edge
+  # of zero length.
+  def edges(self):
+
+    xs = self.points[0::2]
+    ys = self.points[1::2]
+
+    if len(xs) == 1:
+      return [(xs[0], ys[0], xs[0], ys[0])]
+
+    ret = list(zip(xs[:-1], ys[:-1], xs[1:], ys[1:]))
+    if self.filled:
+      ret.append((xs[-1], ys[-1], xs[0], ys[0]))
+
+    return ret
+
+  # Returns whether given canonical tuple of ints is inside polygon, by the
+  # even-odd rule. Always False unless filled.
+  def encloses(self, point):
+
+    if not self.filled:
+      return False
+
+    px, py = point
+    return len([None for x0, y0, x1, y1 in self.edges()
+      if (y0 > py) != (y1 > py) and
+        px < x0 + (py - y0) * (x1 - x0) / (y1 - y0)]) % 2 == 1
+
+  # Returns copy offset by given canonical tuple of ints.
+  def translate(self, offset):
+
+    dx, dy = offset
+    points = list(self.points)
+    points[0::2] = [x + dx for x in points[0::2]]
+    points[1::2] = [y + dy for y in points[1::2]]
+
+    return Shape(points, self.filled, self.radius, self.dark)
+
+# Returns distance between given point and segment, as canonical ints.
+def point_segment_distance(px, py, x0, y0, x1, y1):
+
+  dx, dy = x1 - x0, y1 - y0
+  length = dx * dx + dy * dy
+
+  if length == 0:
+    return math.hypot(px - x0, py - y0)
+
+  t = max(0., min(1., ((px - x0) * dx + (py - y0) * dy) / length))
+  return math.hypot(px - x0 - t * dx, py - y0 - t * dy)
+
+# Returns distance between given segments, 0 if they intersect.
+def segment_distance(a, b):
+
+  ax0, ay0, ax1, ay1 = a
+  bx0, by0, bx1, by1 = b
+
+  # intersect if each segment's ends are on opposite sides of the other
+  d1 = (bx1 - bx0) * (ay0 - by0) - (by1 - by0) * (ax0 - bx0)
+  d2 = (bx1 - bx0) * (ay1 - by0) - (by1 - by0) * (ax1 - bx0)
+  d3 = (ax1 - ax0) * (by0 - ay0) - (ay1 - ay0) * (bx0 - ax0)
+  d4 = (ax1 - ax0) * (by1 - ay0) - (ay1 - ay0) * (bx1 - ax0)
+  if ((d1 > 0 and d2 < 0) or (d1 < 0 and d2 > 0)) and \
+    ((d3 > 0 and d4 < 0) or (d3 < 0 and d4 > 0)):
+    return 0.
+
+  return min(point_segment_distance(ax0, ay0, *b),
+    point_segment_distance(ax1, ay1, *b),
+    point_segment_distance(bx0, by0, *a),
+    point_segment_distance(bx1, by1, *a))
+
+# Returns distance from given shape to given canonical tuple of ints, 0 if
+# covered.
+def point_distance(shape, point):
+
+  if shape.encloses(point):
+    return 0.
+
+  px, py = point
+  dist = min([point_segment_distance(px, py, *edge)
+    for edge in shape.edges()])
+
+  return max(0., dist - shape.radius)
+
+# Returns distance between areas covered by given shapes, 0 if they overlap.
+# Only edges within limit of the other shape's bounds are compared, so
+# distances beyond limit are not exact.
+def shape_distance(a, b, limit=float('inf')):
+
+  if a.encloses((b.points[0], b.points[1])) or \
+    b.encloses((a.points[0], a.points[1])):
+    return 0.
+
+  margin = limit + a.radius + b.radius
+  a_edges = near_edges(a.edges(), b.bounds, margin)
+  b_edges = near_edges(b.edges(), a.bounds, margin)
+
+  if len(a_edges) == 0 or len(b_edges) == 0:
+    return max(0., box_distance(a.bounds, b.bounds))
+
+  dist = min([segment_distance(edge_a, edge_b)
+    for edge_a in a_edges for edge_b in b_edges])
+
+  return max(0., dist - a.radius - b.radius)
+
+# Returns edges with bounds within margin of given bounds.
+def near_edges(edges, bounds, margin):
+
+  x_min, y_min = bounds[0] - margin, bounds[1] - margin
+  x_max, y_max = bounds[2] + margin, bounds[3] + margin
+
+  return [edge for edge in edges
+    if min(edge[0], edge[2]) <= x_max and max(edge[0], edge[2]) >= x_min and
+      min(edge[1], edge[3]) <= y_max and max(edge[1], edge[3]) >= y_min]
+
+# Returns distance between given bounds, 0 if they overlap.
+def box_distance(a, b):
+  dx = max(a[0] - b[2], b[0] - a[2], 0)
+  dy = max(a[1] - b[3], b[1] - a[3], 0)
+  return math.hypot(dx, dy)
+
+# Returns distance from given bounds to given canonical tuple of ints.
+def box_point_distance(bounds, point):
+  return box_distance(bounds, (point[0], point[1], point[0], point[1]))
+
+# Returns Shapes of given graphic, in the order they are drawn. Polarity of
+# the graphic itself is given as dark; polarity of objects nested in
+# blocks is relative to it.
+def shapes(obj, dark=True, segments=numeric.ARC_SEGMENTS):
+
+  cls = type(obj)
+
+  if issubclass(cls, graphic.Region):
+    return [Shape(list(loop), True, 0., dark)
+      for loop in obj.contour.loops(segments) if len(loop) > 0]
+
+  elif issubclass(cls, graphic.FlashObject):
+    return aperture_shapes(obj.ap, obj.ap_transform,
+      numeric.Vector.quantize(obj.vector), dark, segments)
+
+  elif issubclass(cls, graphic.FlashArray):
+    local = local_shapes(obj.ap, obj.ap_transform, dark, segments)
+    return [shape.translate(point)
+      for point in zip(obj.points[0::2], obj.points[1::2])
+      for shape in local]
+
+  elif issubclass(cls, graphic.Track):
+    return track_shapes(obj, dark, segments)
+
+  elif issubclass(cls, graphic.Block):
+    ret = list()
+    for nested in obj.objects:
+      ret += shapes(nested, dark == (nested.polarity == gbrtypes.Dark),
+        segments)
+    return ret
+
+  elif issubclass(cls, graphic.Instance):
+    return [shape.translate(obj.offset)
+      for shape in shapes(obj.block, dark, segments)]
+
+  elif issubclass(cls, graphic.StepRepeat):
+    block = shapes(obj.block, dark, segments)
+    return [shape.translate(position) for position in obj.positions
+      for shape in block]
+
+  raise Exception('Shapes not supported: %s' % (cls.__name__))
+
+# Returns Shapes of given aperture flashed at given canonical tuple of ints,
+# with given aperture transform or None.
+def aperture_shapes(ap, ap_transform, center, dark=True,
+  segments=numeric.ARC_SEGMENTS):
+
+  if type(ap) is aperture.Circle:
+    radius = ap.params[0] * env.codec.scale / 2
+    if not ap_transform is None: radius *= ap_transform.scale
+    return [Shape(list(center), False, radius, dark)]
+
+  return [shape.translate(center)
+    for shape in local_shapes(ap, ap_transform, dark, segments)]
+
+# Returns Shapes of given aperture with given aperture transform or None,
+# flashed at the origin.
+def local_shapes(ap, ap_transform, dark=True, segments=numeric.ARC_SEGMENTS):
+
+  transform = ap_transform
+  if transform is None: transform = numeric.Transform()
+
+  cls = type(ap)
+
+  if issubclass(cls, aperture.BlockAperture):
+    block = ap.block.transform(transform)
+    return shapes(block, dark == (ap.polarity == gbrtypes.Dark), segments)
+
+  scale = env.codec.scale
+  params = [param * scale for param in ap.params]
+
+  def local(points):
+    ret = list()
+    for point in points:
+      ret.extend(transform.apply(
+        (int(round(point[0])), int(round(point[1])))))
+    return ret
+
+  if cls is aperture.Circle:
+    return [Shape([0, 0], False, params[0] / 2 * transform.scale, dark)]
+
+  elif cls is aperture.Rectangle:
+    w, h = params[0] / 2, params[1] / 2
+    return [Shape(local([(-w, -h), (w, -h), (w, h), (-w, h)]), True, 0.,
+      dark)]
+
+  elif cls is aperture.Obround:
+    w, h = params[0] / 2, params[1] / 2
+    if w >= h:
+      ends = [(h - w, 0), (w - h, 0)]
+    else:
+      ends = [(0, w - h), (0, h - w)]
+    return [Shape(local(ends), False, min(w, h) * transform.scale, dark)]
+
+  elif issubclass(cls, aperture.Polygon):
+    radius, count, rotation = params[0] / 2, int(ap.params[1]), ap.params[2]
+    return [Shape(local([(
+      radius * math.cos(math.radians(rotation + idx * 360. / count)),
+      radius * math.sin(math.radians(rotation + idx * 360. / count)))
+      for idx in range(count)]), True, 0., dark)]
+
+  raise Exception('Shapes not supported: %s' % (str(ap)))
+
+# Returns Shapes of given track: chains within the radius of a circle, or
+# the hull of a rectangle swept along each segment.
+def track_shapes(track, dark=True, segments=numeric.ARC_SEGMENTS):
+
+  ret = list()
+
+  if type(track.ap) is aperture.Circle:
+    radius = track_radius(track)
+    for loop in track.contour.loops(segments):
+      if len(loop) > 0:
+        ret.append(Shape(list(loop), False, radius, dark))
+    return ret
+
+  local = [point for shape in local_shapes(track.ap, track.ap_transform)
+    for point in zip(shape.points[0::2], shape.points[1::2])]
+
+  for loop in track.contour.loops(segments):
+    xs = loop[0::2]
+    ys = loop[1::2]
+
+    for x0, y0, x1, y1 in zip(xs[:-1], ys[:-1], xs[1:], ys[1:]):
+      corners = [(x0 + x, y0 + y) for x, y in local] + \
+        [(x1 + x, y1 + y) for x, y in local]
+      ret.append(Shape(convex_hull(corners), True, 0., dark))
+
+  return ret
+
+# Returns radius of circle aperture of given track, in canonical units.
+def track_radius(track):
+
+  radius = track.ap.params[0] * env.codec.scale / 2
+  if not track.ap_transform is None:
+    radius *= track.ap_transform.scale
+
+  return radius
+
+# Returns convex hull of given points, as flat list of ints in
+# counterclockwise order.
+def convex_hull(points):
+
+  points = sorted(set(points))
+  if len(points) < 3:
+    return [val for point in points for val in point]
+
+  def cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+  lower = list()
+  upper = list()
+  for point in points:
+    while len(lower) > 1 and cross(lower[-2], lower[-1], point) <= 0:
+      lower.pop()
+    lower.append(point)
+  for point in reversed(points):
+    while len(upper) > 1 and cross(upper[-2], upper[-1], point) <= 0:
+      upper.pop()
+    upper.append(point)
+
+  return [val for point in lower[:-1] + upper[:-1] for val in point]
+
+# Returns whether image of given graphic, taken as dark, covers given
+# canonical tuple of ints. Later shapes are drawn over earlier ones.
+def covers(obj, point):
+
+  for shape in reversed(shapes(obj)):
+    if box_point_distance(shape.bounds, point) == 0 and \
+      point_distance(shape, point) == 0:
+      return shape.dark
+
+  return False
+
+# ------------------------------------------------------------------------------
+# Index of graphics by bounding box, in a uniform grid of square cells.
+#
+# Each object is listed in every cell its bounds overlap, so queries only
+# visit cells near the area queried. Objects overlapping many cells, e.g. a
+# board outline, are kept in a separate list checked by every query.
+# Objects are added incrementally, and are not expected to change once
+# added.
+# ------------------------------------------------------------------------------
+class GridIndex:
+
+  # Side of cells as canonical int, chosen from the objects first added if
+  # not given.
+  cell = int
+
+  # Ids of objects by (column, row) of cell.
+  cells = dict
+
+  # Objects and their bounds, by id in order added.
+  objects = list
+  bounds = list
+
+  # Ids of objects overlapping more than max_cells cells.
+  large = list
+  max_cells = 64
+
+  # (col_min, row_min, col_max, row_max) of cells listed, or None if empty.
+  extent = tuple
+
+  # cell: side of cells as Vector component, e.g. float in units; if None,
+  #   a multiple of the typical size of objects first added
+  def __init__(self, cell=None):
+
+    if not cell is None:
+      cell = max(1, numeric.Scalar.quantize(cell))
+
+    self.cell = cell
+    self.cells = dict()
+    self.objects = list()
+    self.bounds = list()
+    self.large = list()
+    self.extent = None
+
+  def __len__(self):
+    return len(self.objects)
+
+  # Replaces objects indexed with given graphics, keeping cell size if
+  # chosen.
+  def rebuild(self, objs):
+
+    self.cells = dict()
+    self.objects = list()
+    self.bounds = list()
+    self.large = list()
+    self.extent = None
+
+    self.extend(objs)
+
+  # Add given graphic. Graphics without bounds, e.g. commands, are skipped.
+  def insert(self, obj):
+    self.extend([obj])
+
+  # Add given graphics.
+  def extend(self, objs):
+
+    entries = [(obj, obj.bounds()) for obj in objs if hasattr(obj, 'bounds')]
+    entries = [entry for entry in entries if not entry[1] is None]
+
+    if self.cell is None and len(entries) > 0:
+      sizes = sorted([max(bounds[2] - bounds[0], bounds[3] - bounds[1])
+        for obj, bounds in entries])
+      self.cell = max(1, 4 * sizes[len(sizes) // 2])
+
+    for obj, bounds in entries:
+      self.add(obj, bounds)
+
+  def add(self, obj, bounds):
+
+    idx = len(self.objects)
+    self.objects.append(obj)
+    self.bounds.append(bounds)
+
+    cell = self.cell
+    cols = range(bounds[0] // cell, bounds[2] // cell + 1)
+    rows = range(bounds[1] // cell, bounds[3] // cell + 1)
+
+    if len(cols) * len(rows) > self.max_cells:
+      self.large.append(idx)
+      return
+
+    extent = self.extent
+    if extent is None: extent = (cols[0], rows[0], cols[-1], rows[-1])
+    self.extent = (min(extent[0], cols[0]), min(extent[1], rows[0]),
+      max(extent[2], cols[-1]), max(extent[3], rows[-1]))
+
+    cells = self.cells
+    for col in cols:
+      for row in rows:
+        key = (col, row)
+        if key in cells:
+          cells[key].append(idx)
+        else:
+          cells[key] = [idx]
+
+  # Returns ids of objects listed in cells overlapping given bounds, and
+  # of large objects.
+  def candidates(self, bounds):
+
+    cell = self.cell
+    cols = range(bounds[0] // cell, bounds[2] // cell + 1)
+    rows = range(bounds[1] // cell, bounds[3] // cell + 1)
+
+    ret = set(self.large)
+
+    # visit whichever is fewer, cells in bounds or cells listed
+    if len(cols) * len(rows) <= len(self.cells):
+      for col in cols:
+        for row in rows:
+          ret.update(self.cells.get((col, row), ()))
+    else:
+      for (col, row), ids in self.cells.items():
+        if col in cols and row in rows:
+          ret.update(ids)
+
+    return ret
+
+  # Returns objects whose bounds overlap the window from given lower to
+  # upper corner, as Vectors or tuples, in order added.
+  def window(self, lower, upper):
+
+    if len(self.objects) == 0:
+      return list()
+
+    x_min, y_min = numeric.Vector.quantize(lower)
+    x_max, y_max = numeric.Vector.quantize(upper)
+
+    return self.query((x_min, y_min, x_max, y_max))
+
+  # Returns objects whose bounds overlap given bounds as canonical ints, in
+  # order added.
+  def query(self, bounds):
+
+    if len(self.objects) == 0:
+      return list()
+
+    x_min, y_min, x_max, y_max = bounds
+    ids = [idx for idx in self.candidates(bounds)
+      if self.bounds[idx][0] <= x_max and self.bounds[idx][2] >= x_min and
+        self.bounds[idx][1] <= y_max and self.bounds[idx][3] >= y_min]
+
+    return [self.objects[idx] for idx in sorted(ids)]
+
+  # Returns objects whose image, taken as dark, covers given Vector or
+  # tuple, in order added.
+  def hit(self, point):
+
+    if len(self.objects) == 0:
+      return list()
+
+    point = numeric.Vector.quantize(point)
+    return [obj for obj in self.query(point + point) if covers(obj, point)]
+
+  # Returns up to count (distance, object) tuples of objects nearest to
+  # given Vector or tuple, nearest first. Distance is in units, from the
+  # point to the image of the object taken as dark; 0 if covered.
+  def nearest(self, point, count=1):
+
+    if len(self.objects) == 0:
+      return list()
+
+    px, py = numeric.Vector.quantize(point)
+    cell = self.cell
+    col, row = (px // cell, py // cell)
+
+    # rings of cells around point needed to reach every cell listed
+    max_ring = 0
+    if not self.extent is None:
+      max_ring = max(col - self.extent[0], self.extent[2] - col,
+        row - self.extent[1], self.extent[3] - row, 0)
+
+    # exact distances by id, of objects possibly among nearest, and max-heap
+    # of negated best count distances, bounding those still to be visited
+    found = dict()
+    best = list()
+    visited = set()
+
+    def visit(ids):
+      for idx in ids:
+        if idx in visited:
+          continue
+        visited.add(idx)
+
+        # exact distance is at least distance to bounds
+        if len(best) == count and \
+          box_point_distance(self.bounds[idx], (px, py)) >= -best[0]:
+          continue
+
+        dist = min([point_distance(shape, (px, py))
+          for shape in shapes(self.objects[idx])] + [float('inf')])
+        found[idx] = dist
+        if len(best) < count:
+          heapq.heappush(best, -dist)
+        elif dist < -best[0]:
+          heapq.heapreplace(best, -dist)
+
+    visit(self.large)
+
+    for ring in range(max_ring + 1):
+      for key in ring_cells(col, row, ring):
+        visit(self.cells.get(key, ()))
+
+      # cells beyond next ring are at least this far from point
+      if len(best) == count and -best[0] <= ring * cell:
+        break
+
+    ret = sorted([(dist, idx) for idx, dist in found.items()])[:count]
+    return [(dist / env.codec.scale, self.objects[idx]) for dist, idx in ret]
+
+# Yields (column, row) of cells in square ring at given distance in cells
+# around given cell.
+def ring_cells(col, row, ring):
+
+  if ring == 0:
+    yield (col, row)
+    return
+
+  for offset in range(-ring, ring + 1):
+    yield (col + offset, row - ring)
+    yield (col + offset, row + ring)
+  for offset in range(-ring + 1, ring):
+    yield (col - ring, row + offset)
+    yield (col + ring, row + offset)
@@ -0,0 +1,262 @@
+import contextlib
+import hashlib
+import io
+import queue
+import threading
+import time
+
+from common import *
+
+# ------------------------------------------------------------------------------
+# Command stream which renders commands into an output sink as they are
+# appended, rather than accumulating Command objects in a list.
+# Generators appended to the stream are expanded recursively in place.
+# ------------------------------------------------------------------------------
+class Stream:
+
+  # Output sink: file-like object providing write().
+  sink = None
+
+  # Whether sink accepts bytes rather than str.
+  binary = bool
+
+  # Rendered lines pending write to sink.
+  buffer = list
+
+  # Number of lines to accumulate before writing to sink.
+  buffer_len = int
+
+  # Number of commands rendered so far.
+  count = int
+
+  # Number of commands rendered so far, by class.
+  counts = dict
+
+  # Number of bytes written to sink so far, as encoded in UTF-8 for text
+  # sinks.
+  bytes = int
+
+  # Running MD5 digest of rendered contents, not including line endings.
+  md5 = None
+
+  # Seconds spent updating digest and writing to sink, respectively.
+  md5_time = float
+  io_time = float
+
+  def __init__(self, sink, buffer_len=1024):
+
+    self.sink = sink
+    self.binary = isinstance(sink, (io.RawIOBase, io.BufferedIOBase))
+    self.buffer = list()
+    self.buffer_len = buffer_len
+    self.count = 0
+    self.counts = dict()
+    self.bytes = 0
+    self.md5 = hashlib.md5()
+    self.md5_time = 0.
+    self.io_time = 0.
+
+  # Render given Command, or expand given Generator, into sink.
+  def append(self, cmd):
+
+    cls = type(cmd)
+
+    if issubclass(cls, Renderable):
+      self.buffer.append(cmd.render())
+      self.count += 1
+      self.counts[cls] = self.counts.get(cls, 0) + 1
+
+      if len(self.buffer) >= self.buffer_len:
+        self.flush()
+
+    elif issubclass(cls, Generator):
+      cmd.generate(self)
+    else:
+      raise Exception('Command not renderable: %s' % (str(cmd)))
+
+  # Write pending lines to sink, updating digest.
+  def flush(self):
+
+    if len(self.buffer) == 0:
+      return
+
+    start = time.perf_counter()
+
+    out = '\n'.join(self.buffer) + '\n'
+
+    # commands may render multiple lines, so strip all line endings
+    self.md5.update(out.replace('\n', '').encode('utf-8'))
+
+    data = out.encode('utf-8')
+    if self.binary: out = data
+    self.bytes += len(data)
+
+    written = time.perf_counter()
+    self.md5_time += written - start
+
+    self.sink.write(out)
+    self.buffer = list()
+
+    self.io_time += time.perf_counter() - written
+
+  # Returns MD5 of contents rendered so far as hex string.
+  def hexdigest(self):
+    self.flush()
+    return self.md5.hexdigest()
+
+# ------------------------------------------------------------------------------
+# Binary sink passing writes to another binary sink, e.g. a compressed file or
+# archive member, on a worker thread, so compression overlaps rendering.
+# Writes are coalesced into large blocks, since the worker needs the GIL
+# between blocks. Pending blocks are bounded, so memory use does not grow if
+# the worker falls behind. The wrapped sink is closed along with this sink.
+# ------------------------------------------------------------------------------
+class ThreadedSink (io.RawIOBase):
+
+  # Wrapped sink.
+  sink = None
+
+  # Data written but not yet passed to worker, and its length.
+  pending = list
+  pending_len = int
+
+  # Minimum length of data passed to worker at once.
+  block_len = int
+
+  # Blocks to write, None to stop worker.
+  queue = queue.Queue
+
+  worker = threading.Thread
+
+  # Exception raised by wrapped sink, re-raised by write() or close().
+  error = None
+
+  def __init__(self, sink, block_len=1 << 20, queue_len=4):
+    io.RawIOBase.__init__(self)
+
+    self.sink = sink
+    self.pending = list()
+    self.pending_len = 0
+    self.block_len = block_len
+    self.queue = queue.Queue(queue_len)
+    self.error = None
+
+    self.worker = threading.Thread(target=self.run, daemon=True)
+    self.worker.start()
+
+  def writable(self):
+    return True
+
+  def write(self, data):
+
+    if not self.error is None:
+      raise self.error
+
+    self.pending.append(data)
+    self.pending_len += len(data)
+
+    if self.pending_len >= self.block_len:
+      self.queue.put(b''.join(self.pending))
+      self.pending = list()
+      self.pending_len = 0
+
+    return len(data)
+
+  # Waits for pending writes, then closes wrapped sink.
+  def close(self):
+
+    if self.closed:
+      return
+
+    if self.pending_len > 0:
+      self.queue.put(b''.join(self.pending))
+      self.pending = list()
+
+    self.queue.put(None)
+    self.worker.join()
+    io.RawIOBase.close(self)
+
+    self.sink.close()
+
+    if not self.error is None:
+      raise self.error
+
+  # Writes pending data to wrapped sink until stopped. After an error, data
+  # is discarded so writers are not blocked.
+  def run(self):
+
+    while True:
+      data = self.queue.get()
+      if data is None:
+        break
+
+      if self.error is None:
+        try:
+          self.sink.write(data)
+        except Exception as e:
+          self.error = e
+
+# ------------------------------------------------------------------------------
+# Statistics of rendering a layer into a Stream, returned by Layer.write().
+# Phase times exclude time spent hashing and writing, which are reported as
+# the 'md5' and 'io' phases.
+# ------------------------------------------------------------------------------
+class Stats:
+
+  # Seconds of wall time by phase name, in order.
+  phases = dict
+
+  # Number of commands rendered, by class name.
+  commands = dict
+
+  # Number of bytes written.
+  bytes = int
+
+  # Number of redundant mode changes suppressed by the engine.
+  suppressed = int
+
+  def __init__(self):
+
+    self.phases = dict()
+    self.commands = dict()
+    self.bytes = 0
+    self.suppressed = 0
+
+  def __str__(self):
+
+    phases = ', '.join('%s %.3fs' % (name, seconds)
+      for name, seconds in self.phases.items())
+
+    return '%.3fs (%s), %d commands, %d bytes, %d suppressed' % (
+      self.total, phases, sum(self.commands.values()), self.bytes,
+      self.suppressed)
+
+  # Total seconds of all phases.
+  @property
+  def total(self):
+    return sum(self.phases.values())
+
+  # Times a with block as given phase of rendering into given stream.
+  @contextlib.contextmanager
+  def phase(self, name, stream):
+
+    overhead = stream.md5_time + stream.io_time
+    start = time.perf_counter()
+
+    try:
+      yield
+    finally:
+      elapsed = time.perf_counter() - start
+      overhead = stream.md5_time + stream.io_time - overhead
+      self.phases[name] = self.phases.get(name, 0.) + elapsed - overhead
+
+  # Collects counters of given stream once rendering is complete.
+  def collect(self, stream):
+
+    self.phases['md5'] = self.phases.get('md5', 0.) + stream.md5_time
+    self.phases['io'] = self.phases.get('io', 0.) + stream.io_time
+
+    for cls, count in stream.counts.items():
+      self.commands[cls.__name__] = self.commands.get(cls.__name__, 0) + count
+
+    self.bytes += stream.bytes
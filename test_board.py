@@ -0,0 +1,49 @@
+import os
+
+import gbrtypes
+import environment
+from environment import Environment as env
+import aperture
+import graphic
+import layer
+import board
+
+env.init(gbrtypes.CoordinateFormat(2, 6), gbrtypes.Inch)
+
+def build():
+
+  b = board.Board()
+
+  for idx in range(3):
+    l = layer.CopperLayer(idx + 1, registry=b.registry)
+    for x in range(20):
+      l.append(graphic.FlashObject(aperture.Circle(0.01 * (idx + 1)),
+        (0.1 * x, 0.1 * idx)))
+    l.append(graphic.Region([(0, 0), (1, 0), (1, 1)]))
+    l.append(graphic.Track(aperture.Rectangle(0.02, 0.01),
+      [(0, 2), (2, 2)]))
+    b.add(l, 'layer%d.gbr' % (idx + 1))
+
+  return b
+
+def read(paths):
+  ret = list()
+  for path in paths:
+    with open(path, 'rb') as fh:
+      ret.append(fh.read())
+  return ret
+
+# Layers written by worker processes are identical to those written
+# serially.
+def test_parallel_matches_serial(tmp_path):
+
+  b = build()
+  profile = environment.Profile(compact=True)
+
+  serial = b.write(str(tmp_path / 'serial'), processes=1, profile=profile)
+  parallel = b.write(str(tmp_path / 'parallel'), processes=3,
+    profile=profile)
+
+  assert [os.path.basename(path) for path in serial] == \
+    [os.path.basename(path) for path in parallel]
+  assert read(serial) == read(parallel)
@@ -0,0 +1,68 @@
+import gbrtypes
+from environment import Environment as env
+import aperture
+import graphic
+import layer
+import drc
+
+env.init(gbrtypes.CoordinateFormat(2, 6), gbrtypes.Inch)
+
+def rules(violations):
+  return [(val.rule, [type(obj).__name__ for obj in val.objects])
+    for val in violations]
+
+# Flash and track closer than clearance are reported; tracks touching the
+# same region are connected and are not.
+def test_clearance():
+
+  l = layer.CopperLayer(1)
+  l.append(graphic.FlashObject(aperture.Circle(0.06), (0, 0)))
+  l.append(graphic.Track(aperture.Circle(0.01), [(0, 0.04), (0.5, 0.04)]))
+
+  l.append(graphic.Region([(2, 1), (3, 1), (3, 1.5), (2, 1.5)]))
+  l.append(graphic.Track(aperture.Circle(0.01), [(2.5, 1.4), (2.5, 1.6)]))
+  l.append(graphic.Track(aperture.Circle(0.01),
+    [(2.507, 1.45), (2.507, 1.6)]))
+
+  violations = l.check(clearance=0.006)
+  assert rules(violations) == [('clearance', ['FlashObject', 'Track'])]
+  assert abs(violations[0].measured - 0.005) < 1e-6
+
+# Thin track and region are reported, wider ones are not.
+def test_width():
+
+  l = layer.CopperLayer(1)
+  l.append(graphic.Track(aperture.Circle(0.003), [(0, 1), (0.5, 1)]))
+  l.append(graphic.Track(aperture.Circle(0.01), [(0, 2), (0.5, 2)]))
+  l.append(graphic.Region([(2, 0), (3, 0), (3, 0.002), (2, 0.002)]))
+  start = (0.5, 0)
+  l.append(graphic.Region([graphic.Segment((start, start),
+    gbrtypes.CounterClockwise(), center=(0, 0))]))
+
+  violations = l.check(width=0.005)
+  assert rules(violations) == [('width', ['Track']), ('width', ['Region'])]
+  assert [round(val.measured, 6) for val in violations] == [0.003, 0.002]
+
+# Pad with too little copper around its hole is reported.
+def test_annular():
+
+  l = layer.CopperLayer(1)
+  l.append(graphic.FlashObject(aperture.Circle(0.06, 0.04), (0, 0)))
+  l.append(graphic.FlashObject(aperture.Circle(0.06, 0.052), (1, 0)))
+
+  violations = l.check(annular=0.005)
+  assert rules(violations) == [('annular', ['FlashObject'])]
+  assert violations[0].location == (1, 0)
+
+# Checking in tiles on worker processes finds the same violations.
+def test_parallel_tiles():
+
+  l = layer.CopperLayer(1)
+  for idx in range(40):
+    l.append(graphic.FlashObject(aperture.Circle(0.02), (0.023 * idx, 0)))
+
+  serial = l.check(clearance=0.006)
+  parallel = l.check(clearance=0.006, processes=2, tile=0.2)
+
+  assert len(serial) == 39
+  assert [str(val) for val in serial] == [str(val) for val in parallel]
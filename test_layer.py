@@ -0,0 +1,74 @@
+import gc
+import gzip
+import os
+import threading
+import weakref
+
+import pytest
+
+import common
+import gbrtypes
+from environment import Environment as env
+import aperture
+import graphic
+import layer
+
+env.init(gbrtypes.CoordinateFormat(2, 6), gbrtypes.Inch)
+
+# Identical inline apertures share a D-code and are not kept alive.
+def test_inline_apertures_not_retained():
+
+  l = layer.CopperLayer(1)
+  refs = list()
+
+  for idx in range(1000):
+    ap = aperture.Circle(0.01)
+    refs.append(weakref.ref(ap))
+    l.append(graphic.FlashObject(ap, (idx * 0.001, 0)))
+  del ap
+  gc.collect()
+
+  assert len(l.apertures) == 1
+  assert len(l.registry.members) == 1
+  assert len([ref for ref in refs if not ref() is None]) == 1
+  assert all([obj.ap is l.apertures[0] for obj in l.graphics])
+
+# Graphic failing to generate.
+class Failing (common.Generator):
+  def generate(self, stream):
+    raise Exception('Failing')
+  def cleanup(self, stream):
+    pass
+
+# Failed write closes the file and its compression thread and removes it.
+def test_write_failure_removes_file(tmp_path):
+
+  threads = threading.active_count()
+
+  for name in ('failed.gbr', 'failed.gbr.gz'):
+    l = layer.CopperLayer(1)
+    l.append(graphic.FlashObject(aperture.Circle(0.01), (0, 0)))
+    l.append(Failing())
+
+    path = str(tmp_path / name)
+    with pytest.raises(Exception, match='Failing'):
+      l.write(path)
+
+    assert not os.path.exists(path)
+    assert threading.active_count() == threads
+
+# Bytes written are counted as encoded, for text and binary files alike.
+def test_write_counts_bytes(tmp_path):
+
+  l = layer.CopperLayer(1, project_id=gbrtypes.ProjectId('café', '1.0'))
+  l.append(graphic.FlashObject(aperture.Circle(0.01), (0, 0)))
+
+  for name in ('text.gbr', 'binary.gbr.gz'):
+    path = str(tmp_path / name)
+    stats = l.write(path)
+    if name.endswith('.gz'):
+      with gzip.open(path, 'rb') as fh:
+        size = len(fh.read())
+    else:
+      size = os.path.getsize(path)
+    assert stats.bytes == size
@@ -0,0 +1,92 @@
+import io
+
+import gbrtypes
+from environment import Environment as env
+import aperture
+import graphic
+import layer
+import reader
+import spatial
+
+env.init(gbrtypes.CoordinateFormat(2, 6), gbrtypes.Inch)
+
+# Returns whether each of given points, as tuples in units, is dark after
+# drawing given graphics in order.
+def image(graphics, points):
+
+  points = [spatial.numeric.Vector.quantize(point) for point in points]
+  ret = [False] * len(points)
+
+  for obj in graphics:
+    for shape in spatial.shapes(obj, obj.polarity == gbrtypes.Dark):
+      for idx, point in enumerate(points):
+        if spatial.box_point_distance(shape.bounds, point) == 0 and \
+          spatial.point_distance(shape, point) == 0:
+          ret[idx] = shape.dark
+
+  return ret
+
+# Points on a grid spanning given lower and upper corners, in units.
+def grid(lower, upper, count=40):
+  return [(lower[0] + (upper[0] - lower[0]) * i / count,
+    lower[1] + (upper[1] - lower[1]) * j / count)
+    for i in range(count + 1) for j in range(count + 1)]
+
+# Block aperture of a dark disc with a clear square hole at its center.
+def holed():
+  block = graphic.Block([graphic.FlashObject(aperture.Circle(0.06), (0, 0))])
+  block -= graphic.Region([(-0.02, -0.02), (0.02, -0.02), (0.02, 0.02),
+    (-0.02, 0.02)])
+  return aperture.BlockAperture(block)
+
+# Block aperture of dark objects only.
+def plain():
+  return aperture.BlockAperture(graphic.Block([
+    graphic.FlashObject(aperture.Rectangle(0.04, 0.02), (0, 0))]))
+
+# Flash of a block aperture clearing a hole must stay after the disc below
+# it, even though moving it would shorten travel.
+def test_optimize_travel_keeps_clearing_block_aperture():
+
+  l = layer.CopperLayer(1)
+  l.append(graphic.FlashObject(aperture.Circle(0.1), (1, 1)))
+  l.append(graphic.FlashObject(holed(), (0.98, 0.98)))
+  l.append(graphic.FlashObject(plain(), (0, 0)))
+
+  points = grid((0.9, 0.9), (1.1, 1.1))
+  before = image(l.graphics, points)
+  assert not all(before) and any(before)
+
+  l.optimize_travel()
+  assert image(l.graphics, points) == before
+
+# Layer written with graphics grouped by aperture reads back to the same
+# image as written ungrouped.
+def test_group_apertures_keeps_image():
+
+  ap = aperture.Circle(0.1)
+  holed_ap = holed()
+  plain_ap = plain()
+
+  def build(group_apertures):
+    l = layer.CopperLayer(1)
+    l.group_apertures = group_apertures
+    for idx in range(4):
+      x = 0.3 * idx
+      l.append(graphic.FlashObject(ap, (x, 0)))
+      l.append(graphic.FlashObject(plain_ap, (x + 0.15, 0)))
+      l.append(graphic.FlashObject(holed_ap, (x + 0.02, 0)))
+      l.append(graphic.FlashObject(ap, (x + 0.04, 0.05)))
+    return l
+
+  points = grid((-0.1, -0.1), (1.1, 0.2), 60)
+  images = list()
+
+  for group_apertures in (False, True):
+    out = io.StringIO()
+    build(group_apertures).write(out)
+    out.seek(0)
+    images.append(image(reader.Reader().read(out).graphics, points))
+
+  assert images[0] == images[1]
+  assert any(images[0]) and not all(images[0])
@@ -0,0 +1,68 @@
+import io
+
+import pytest
+
+import gbrtypes
+import environment
+from environment import Environment as env
+import aperture
+import graphic
+import layer
+import reader
+
+env.init(gbrtypes.CoordinateFormat(2, 6), gbrtypes.Inch)
+
+# Layer using each kind of graphic and aperture transform.
+def build():
+
+  l = layer.CopperLayer(1)
+
+  start = (0.3, 0)
+  l.append(graphic.Region([graphic.Segment((start, start),
+    gbrtypes.CounterClockwise(), center=(0, 0))]))
+  l.append(graphic.Region([(1, 0), (1.2, 0), (1.2, 0.1)], gbrtypes.Clear()))
+
+  l.append(graphic.FlashObject(aperture.Circle(0.02, 0.01), (0.5, 0.5)))
+  l.append(graphic.FlashObject(aperture.Rectangle(0.02, 0.01),
+    (0.6, 0.5)).rotate(30, (0.6, 0.5)))
+  l.append(graphic.FlashObject(aperture.Obround(0.02, 0.01), (0.8, 0.5)))
+  l.append(graphic.FlashObject(aperture.Triangle(0.02),
+    (0.7, 0.5)).mirror('X', (0.7, 0.5)).scale(2, (0.7, 0.5)))
+  l.append(graphic.FlashArray(aperture.Hexagon(0.02),
+    [(0.1 * idx, 1) for idx in range(5)]))
+  l.append(graphic.Track(aperture.Circle(0.01), [(0, 2), (1, 2), (1, 3)]))
+
+  block = graphic.Block([graphic.FlashObject(aperture.Circle(0.01), (0, 0))])
+  block -= graphic.Region([(0, 0), (0.01, 0), (0.01, 0.01)])
+  l.append(graphic.FlashObject(aperture.BlockAperture(block), (2, 2)))
+  l.append(graphic.StepRepeat(block,
+    [(3 + 0.1 * i, 3 + 0.2 * j) for i in range(3) for j in range(2)]))
+
+  return l
+
+def render(l, profile):
+  out = io.StringIO()
+  l.write(out, profile)
+  return out.getvalue()
+
+# Layer read back renders to the same output as written.
+@pytest.mark.parametrize('compact', [False, True])
+def test_round_trip(compact):
+
+  profile = environment.Profile(compact=compact, comments=False)
+  text = render(build(), profile)
+
+  for code in ('%SR', '%AB', '%LMX', '%LR', '%LS', 'G03', 'G36', '%LPC'):
+    assert code in text
+
+  assert render(reader.Reader().read(io.StringIO(text)), profile) == text
+
+# Size read counts bytes of the file, including line endings.
+def test_size_counts_bytes():
+
+  data = render(build(), environment.Profile()).replace('\n', '\r\n')
+  data = data.encode('utf-8')
+
+  r = reader.Reader()
+  r.read(io.BytesIO(data))
+  assert r.size == len(data)
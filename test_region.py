@@ -0,0 +1,26 @@
+import io
+
+import gbrtypes
+from environment import Environment as env
+import graphic
+import layer
+
+env.init(gbrtypes.CoordinateFormat(2, 6), gbrtypes.Inch)
+
+# Region of a single repeated vertex is left as is, and can be written.
+def test_simplify_repeated_vertex():
+
+  region = graphic.Region([(1, 1), (1, 1), (1, 1)])
+  assert region.simplify() == 0
+  assert len(region.contour) == 3
+
+  l = layer.CopperLayer(1)
+  l.append(region)
+  l.write(io.StringIO())
+
+# Collinear and repeated vertices are removed.
+def test_simplify_square():
+
+  region = graphic.Region([(0, 0), (0.5, 0), (1, 0), (1, 0), (1, 1), (0, 1)])
+  assert region.simplify() == 2
+  assert len(region.contour) == 4
@@ -0,0 +1,56 @@
+import io
+
+import gbrtypes
+import environment
+from environment import Environment as env
+import aperture
+import graphic
+import layer
+
+env.init(gbrtypes.CoordinateFormat(2, 6), gbrtypes.Inch)
+
+def block():
+  return graphic.Block([graphic.FlashObject(aperture.Circle(0.01), (0, 0))])
+
+def render(obj):
+  l = layer.CopperLayer(1)
+  l.append(obj)
+  out = io.StringIO()
+  l.write(out, environment.Profile(comments=False))
+  return out.getvalue()
+
+# Positions of a full grid in any order are detected as a lattice.
+def test_lattice():
+
+  positions = [(0.1 + 0.2 * x, 0.3 + 0.5 * y)
+    for y in range(3) for x in range(4)]
+  sr = graphic.StepRepeat(block(), list(reversed(positions)))
+
+  assert sr.lattice() == ((100000, 300000), (4, 3), (200000, 500000))
+
+  text = render(sr)
+  assert '%SRX4Y3I0.2J0.5*%' in text
+  assert text.count('D03*') == 1
+
+# Step too small for str() to render without an exponent.
+def test_lattice_small_step():
+  sr = graphic.StepRepeat.grid(block(), (0, 0), (2, 1), (0.00005, 0))
+  assert '%SRX2Y1I0.00005J0*%' in render(sr)
+
+# Positions not forming a full, evenly spaced grid are generated as copies.
+def test_lattice_fallback():
+
+  grid = [(0.2 * x, 0.2 * y) for y in range(2) for x in range(3)]
+  cases = [
+    grid[:-1],
+    grid + grid[:1],
+    [(0, 0), (0.1, 0), (0.3, 0)],
+  ]
+
+  for positions in cases:
+    sr = graphic.StepRepeat(block(), positions)
+    assert sr.lattice() is None
+
+    text = render(sr)
+    assert not '%SR' in text
+    assert text.count('D03*') == len(positions)
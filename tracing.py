@@ -0,0 +1,51 @@
+import logging
+
+# ------------------------------------------------------------------------------
+# Opt-in tracing of per-object events, in place of logging calls on hot paths.
+#
+# Callers guard each call with "if tracing.enabled:", so when tracing is off
+# no message is formatted and no function is called. When on, each event
+# increments a counter by name and, if a hook is set, the message is
+# formatted from its arguments and passed to the hook.
+# ------------------------------------------------------------------------------
+
+# Whether tracing is enabled.
+enabled = False
+
+# Number of events traced, by event name.
+counters = dict()
+
+# Callable taking (event, message) invoked per event, or None to only count.
+hook = None
+
+# Enable tracing, passing messages to given hook if any.
+def enable(fn=None):
+  global enabled, hook
+  enabled = True
+  hook = fn
+
+def disable():
+  global enabled, hook
+  enabled = False
+  hook = None
+
+def reset():
+  counters.clear()
+
+# Record event of given name. message % args is formatted only if a hook is
+# set.
+def trace(event, message=None, *args):
+
+  counters[event] = counters.get(event, 0) + 1
+
+  if not hook is None:
+    if args: message = message % args
+    hook(event, message)
+
+# Returns hook passing messages to given logger at given level.
+def log_hook(level=logging.DEBUG, logger=logging.getLogger()):
+
+  def fn(event, message):
+    logger.log(level, message)
+
+  return fn